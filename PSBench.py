@@ -0,0 +1,81 @@
+import sys
+import time
+
+import PowerScriptattrcache
+import PowerScriptbaseobjects
+from PowerScriptexec import run_file, ENGINES
+from PowerScriptenv import Env
+
+# Time every engine on a PowerScript file. With --allocs, count the
+# PowerScript objects each engine makes instead, and with --caches, how
+# often attribute lookups hit their inline caches.
+# (CMD: "python PSBench.py examples/loops.ps")
+# (CMD: "python PSBench.py --allocs examples/loops.ps")
+# (CMD: "python PSBench.py --caches examples/loops.ps")
+
+args = sys.argv[1:]
+count_allocs = "--allocs" in args
+if count_allocs:
+  args.remove("--allocs")
+count_caches = "--caches" in args
+if count_caches:
+  args.remove("--caches")
+path = args[0] if args else "examples/loops.ps"
+repeat = 3
+
+def run_counting(engine):
+  classes = [PowerScriptbaseobjects.Object]
+  classes += PowerScriptbaseobjects.Value.__subclasses__()
+  old_inits = {cls: cls.__init__ for cls in classes}
+  count = 0
+  def counting(old_init):
+    def init(self, *args, **kwargs):
+      nonlocal count
+      count += 1
+      old_init(self, *args, **kwargs)
+    return init
+  for cls, old_init in old_inits.items():
+    cls.__init__ = counting(old_init)
+  try:
+    run_file(Env(), path, engine)
+  finally:
+    for cls, old_init in old_inits.items():
+      cls.__init__ = old_init
+  return count
+
+if count_allocs:
+  for engine in ENGINES:
+    print(f"{engine:>8}: {run_counting(engine)} objects")
+  sys.exit()
+
+def run_caching(engine):
+  before = PowerScriptattrcache.stats()
+  run_file(Env(), path, engine)
+  after = PowerScriptattrcache.stats()
+  hits = after["hits"] - before["hits"]
+  misses = after["misses"] - before["misses"]
+  return hits, misses, after
+
+if count_caches:
+  for engine in ENGINES:
+    hits, misses, stats = run_caching(engine)
+    rate = hits / (hits + misses) if hits + misses else 0
+    print(f"{engine:>8}: {hits} hits, {misses} misses ({rate:.1%}), "
+          f"{stats['sites']} sites, {stats['polymorphic']} polymorphic")
+  sys.exit()
+
+times = {}
+for engine in ENGINES:
+  best = None
+  for _ in range(repeat):
+    env = Env()
+    start = time.perf_counter()
+    run_file(env, path, engine)
+    took = time.perf_counter() - start
+    if best is None or took < best:
+      best = took
+  times[engine] = best
+
+base = times["tree"]
+for engine, took in times.items():
+  print(f"{engine:>8}: {took:.3f}s ({base / took:.2f}x)")
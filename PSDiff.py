@@ -0,0 +1,54 @@
+import contextlib
+import glob
+import io
+import sys
+
+from PowerScriptexec import run_code, ENGINES
+from PowerScriptenv import Env
+from PowerScriptbuiltins import builtins
+from PowerScriptobjects import BuiltinFunc
+
+# Run PowerScript files with every engine and report any whose output or
+# error differs from the tree walker's.
+# (CMD: "python PSDiff.py examples/*.ps")
+
+# an Env's own builtins have to be found by every engine, though the
+# resolver only knows the default ones
+CUSTOM_BUILTINS = dict(builtins,
+                       greet=BuiltinFunc(lambda env, _, args: args[1]))
+CUSTOM_CODE = "print(greet(5))\nfunc f() { return greet(6) }\nprint(f())\n"
+
+def run(code, engine, env_builtins=builtins):
+  out = io.StringIO()
+  with contextlib.redirect_stdout(out):
+    try:
+      run_code(Env(env_builtins), code, engine)
+    except Exception as err:
+      print(f"{type(err).__name__}: {err}")
+  return out.getvalue()
+
+paths = sys.argv[1:] or sorted(glob.glob("examples/*.ps"))
+
+failures = 0
+for path in paths:
+  with open(path) as f:
+    code = f.read()
+  expected = run(code, "tree")
+  for engine in ENGINES:
+    if engine == "tree":
+      continue
+    got = run(code, engine)
+    if got != expected:
+      failures += 1
+      print(f"{path}: {engine} differs from tree")
+      print(f"--- tree\n{expected}--- {engine}\n{got}")
+
+for engine in ENGINES:
+  got = run(CUSTOM_CODE, engine, CUSTOM_BUILTINS)
+  if got != "5\n6\n":
+    failures += 1
+    print(f"{engine} can't call a custom builtin")
+    print(f"--- {engine}\n{got}")
+
+print(f"{len(paths)} files, {failures} differences")
+sys.exit(1 if failures else 0)
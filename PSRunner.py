@@ -1,10 +1,9 @@
-from PowerScriptexec import run_code
+from PowerScriptexec import run_file
 from PowerScriptenv import Env
 
 # Read & Open PowerScript files.
+# Files over 8MB are run as they are read, so a syntax error in one only
+# stops it once the lines before the error have run.
 
-with open("examples/name.ps") as f:
-  code = f.read()
-  
 env = Env()
-run_code(env, code)
+run_file(env, "examples/name.ps")
@@ -0,0 +1,55 @@
+import glob
+import os
+import sys
+
+from PowerScripttokenizer import _tokenize
+
+# Check that the tokenizer still gives the tokens recorded for each file in
+# examples/tokens, which were written by the per-position tokenizer it
+# replaced. With --write, record the current tokens instead, for when the
+# tokens are meant to change.
+# (CMD: "python PSTokens.py examples/*.ps")
+# (CMD: "python PSTokens.py --write examples/*.ps")
+
+TOKENS_DIR = os.path.join("examples", "tokens")
+
+def token_lines(code):
+  return [f"{tok.name}\t{tok.ind}\t{tok.text!r}\n" for tok in _tokenize(code)]
+
+def tokens_path(path):
+  name = os.path.splitext(os.path.basename(path))[0] + ".tokens"
+  return os.path.join(TOKENS_DIR, name)
+
+args = sys.argv[1:]
+write = "--write" in args
+if write:
+  args.remove("--write")
+paths = args or sorted(glob.glob("examples/*.ps"))
+
+failures = 0
+for path in paths:
+  with open(path) as f:
+    got = token_lines(f.read())
+  if write:
+    os.makedirs(TOKENS_DIR, exist_ok=True)
+    with open(tokens_path(path), "w") as f:
+      f.writelines(got)
+    continue
+
+  try:
+    with open(tokens_path(path)) as f:
+      expected = f.readlines()
+  except OSError:
+    failures += 1
+    print(f"{path}: no recorded tokens")
+    continue
+  if got != expected:
+    failures += 1
+    ind = next((ind for ind, (exp, tok) in enumerate(zip(expected, got))
+                if exp != tok), min(len(expected), len(got)))
+    print(f"{path}: token {ind} differs")
+    print(f"--- expected\n{''.join(expected[ind:ind + 3])}"
+          f"--- got\n{''.join(got[ind:ind + 3])}")
+
+print(f"{len(paths)} files, {failures} differences")
+sys.exit(1 if failures else 0)
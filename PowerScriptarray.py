@@ -0,0 +1,232 @@
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+from PowerScriptobjects import *
+
+# Arrays hold nums in a NumPy ndarray, so operators and reductions on them
+# run as single NumPy calls. A num on either side of an operator is
+# broadcast over the array. Comparisons give one bool, since comparisons
+# always give bools: == is whether every element is equal, and <, <=, >
+# and >= whether they hold for every element.
+#
+# Unlike nums, elements are fixed-size NumPy numbers: integers are int64
+# and wrap around silently on overflow, as NumPy's do.
+
+def need_numpy():
+  if numpy is None:
+    raise PowerScriptError("array needs numpy, which is not installed")
+
+def operand(val):
+  """Returns what NumPy can use for val, or None if it isn't a number."""
+  if val.obj_type is PowerScript_array:
+    return val.vals
+  elif val.obj_type is PowerScript_num:
+    return val.val
+  return None
+
+def py_num(val):
+  """Turns a NumPy scalar into the int or float nums hold."""
+  return val.item() if isinstance(val, numpy.generic) else val
+
+def check_broadcast(err_type, left, right):
+  """Raises err_type if NumPy can't broadcast left and right together."""
+  try:
+    numpy.broadcast_shapes(numpy.shape(left), numpy.shape(right))
+  except ValueError as err:
+    raise err_type("Can't broadcast arrays: {}", str(err)) from None
+
+def vectorized(func, check=None):
+  """Makes an operator method running func(array, other) on the vals.
+
+  check is called with the array and the other operand first, to raise
+  errors nums would raise.
+  """
+  def meth(env, _, args):
+    assert len(args) == 2
+    other = operand(args[1])
+    if other is None:
+      return PowerScript_notimpl
+    check_broadcast(MathError, args[0].vals, other)
+    if check is not None:
+      check(args[0].vals, other)
+    try:
+      return array_from_ndarray(func(args[0].vals, other))
+    except ValueError as err:
+      raise MathError("{}", str(err)) from None
+  return meth
+
+def no_zeros(name, reflected=False):
+  """Makes a check that the divisor, the array if reflected, has no 0."""
+  def check(vals, other):
+    if numpy.any(numpy.asarray(vals if reflected else other) == 0):
+      raise PowerScriptError(f"{name} by 0")
+  return check
+
+def compares(func):
+  """Makes a comparison method, true if func holds for every element."""
+  def meth(env, _, args):
+    assert len(args) == 2
+    other = operand(args[1])
+    if other is None:
+      return PowerScript_notimpl
+    check_broadcast(CompareError, args[0].vals, other)
+    return bool_from_py_bool(bool(numpy.all(func(args[0].vals, other))))
+  return meth
+
+def __eq_array(env, _, args):
+  assert len(args) == 2
+  other = operand(args[1])
+  if other is None:
+    return PowerScript_notimpl
+  if args[1].obj_type is PowerScript_array:
+    return bool_from_py_bool(numpy.array_equal(args[0].vals, other))
+  return bool_from_py_bool(bool(numpy.all(args[0].vals == other)))
+
+def __neq_array(env, _, args):
+  res = __eq_array(env, _, args)
+  if res is PowerScript_notimpl:
+    return res
+  return bool_from_py_bool(not res.val)
+
+def __new_array(env, _, args):
+  need_numpy()
+  return ArrayValue(numpy.zeros(0))
+
+def __init_array(env, _, args):
+  obj, *args = args
+  if not args:
+    obj.vals = numpy.zeros(0)
+  elif len(args) == 1:
+    obj.vals = to_ndarray(args[0])
+  else:
+    raise PowerScriptError("Too many arguments passed to array()")
+
+def to_ndarray(val):
+  if val.obj_type is PowerScript_array:
+    return val.vals.copy()
+  elif val.obj_type is PowerScript_list:
+    return numpy.array([make_num(elem).val for elem in val.vals])
+  raise CastError("Can't convert {} to array", type_name(val))
+
+def __neg_array(env, _, args):
+  assert len(args) == 1
+  return array_from_ndarray(-args[0].vals)
+
+def __call_array(env, _, args):
+  assert len(args) == 2
+  arr = args[0].vals
+  if args[1].obj_type is PowerScript_num:
+    ind = to_int(args[1])
+    if not -len(arr) <= ind < len(arr):
+      raise PowerScriptError("Array index {} out of range", ind)
+    return num_from_py_num(py_num(arr[ind]))
+  elif args[1].obj_type is PowerScript_array:
+    inds = args[1].vals
+    if not numpy.all(inds == inds.astype(int)):
+      raise PowerScriptError("Array indexes must be integers")
+    try:
+      return array_from_ndarray(arr[inds.astype(int)])
+    except IndexError:
+      raise PowerScriptError("Array index out of range") from None
+  else:
+    return PowerScript_notimpl
+
+def __in_array(env, _, args):
+  assert len(args) == 2
+  if args[1].obj_type is PowerScript_num:
+    return bool_from_py_bool(bool(numpy.any(args[0].vals == args[1].val)))
+  return bool_from_py_bool(False)
+
+def __iter_array(env, _, args):
+  return IterValue(map(num_from_py_num, args[0].vals.tolist()))
+
+def __string_array(env, _, args):
+  strings = []
+  for val in args[0].vals.tolist():
+    strings.append(str(int(val)) if is_int(val) else str(val))
+  return string_from_py_string("array(" + ", ".join(strings) + ")")
+
+def reduction(func, name):
+  def meth(env, _, args):
+    arr = args[1].vals
+    if not len(arr):
+      raise PowerScriptError(f"{name} of empty array")
+    return num_from_py_num(py_num(func(arr)))
+  return meth
+
+def sum_array(env, _, args):
+  return num_from_py_num(py_num(args[1].vals.sum()))
+
+def dot_array(env, _, args):
+  if len(args) != 3 or args[2].obj_type is not PowerScript_array:
+    raise PowerScriptError("dot needs an array")
+  left, right = args[1].vals, args[2].vals
+  if len(left) != len(right):
+    raise MathError("Can't dot arrays of length {} and {}",
+                    len(left), len(right))
+  return num_from_py_num(py_num(numpy.dot(left, right)))
+
+def len_array(env, _, args):
+  return num_from_py_num(len(args[1].vals))
+
+def tolist_array(env, _, args):
+  return list_from_py_list([num_from_py_num(val)
+                            for val in args[1].vals.tolist()])
+
+def array_from_ndarray(vals):
+  return ArrayValue(vals)
+
+def make_array(*args):
+  args = list(args)
+  obj = __new_array(None, None, args)
+  __init_array(None, None, [obj] + args)
+  return obj
+
+array_attrs = {
+  "__new": BuiltinFunc(__new_array),
+  "__init": BuiltinFunc(__init_array),
+  "__add": BuiltinFunc(vectorized(lambda a, b: a + b)),
+  "__sub": BuiltinFunc(vectorized(lambda a, b: a - b)),
+  "__rsub": BuiltinFunc(vectorized(lambda a, b: b - a)),
+  "__mul": BuiltinFunc(vectorized(lambda a, b: a * b)),
+  "__div": BuiltinFunc(vectorized(lambda a, b: a / b, no_zeros("Division"))),
+  "__rdiv": BuiltinFunc(vectorized(lambda a, b: b / a, no_zeros("Division", True))),
+  "__mod": BuiltinFunc(vectorized(lambda a, b: a % b, no_zeros("Modulo"))),
+  "__rmod": BuiltinFunc(vectorized(lambda a, b: b % a, no_zeros("Modulo", True))),
+  "__pow": BuiltinFunc(vectorized(lambda a, b: a ** b)),
+  "__rpow": BuiltinFunc(vectorized(lambda a, b: b ** a)),
+  "__neg": BuiltinFunc(__neg_array),
+  "__call": BuiltinFunc(__call_array),
+
+  "__eq": BuiltinFunc(__eq_array),
+  "__neq": BuiltinFunc(__neq_array),
+  "__leq": BuiltinFunc(compares(lambda a, b: a <= b)),
+  "__geq": BuiltinFunc(compares(lambda a, b: a >= b)),
+  "__lt": BuiltinFunc(compares(lambda a, b: a < b)),
+  "__gt": BuiltinFunc(compares(lambda a, b: a > b)),
+
+  "__in": BuiltinFunc(__in_array),
+  "__iter": BuiltinFunc(__iter_array),
+
+  "__string": BuiltinFunc(__string_array),
+
+  "len": BuiltinFunc(len_array),
+  "sum": BuiltinFunc(sum_array),
+  "min": BuiltinFunc(reduction(lambda arr: arr.min(), "min")),
+  "max": BuiltinFunc(reduction(lambda arr: arr.max(), "max")),
+  "mean": BuiltinFunc(reduction(lambda arr: arr.mean(), "mean")),
+  "dot": BuiltinFunc(dot_array),
+  "tolist": BuiltinFunc(tolist_array),
+}
+
+PowerScript_array = Object(PowerScript_type, **array_attrs)
+PowerScript_array.name = "array"
+
+class ArrayValue(Value):
+  __slots__ = ("vals",)
+  obj_type = PowerScript_array
+
+  def __init__(self, vals):
+    self.vals = vals
@@ -2,7 +2,7 @@ import collections
 
 BOOL = {"BOOLAND", "BOOLOR", "BOOLNOT"}
 POW = {"POW"}
-MUL_DIV = {"MUL", "DIV"}
+MUL_DIV = {"MUL", "DIV", "MOD"}
 ADD_SUB = {"ADD", "SUB"}
 SHIFT = {"LSHIFT", "RSHIFT"}
 BIN = {"AND", "OR", "XOR"}
@@ -18,6 +18,8 @@ NODES = {
   "ColonCallExpr": "expr name args",
   "IdentExpr": "ident",
   "ListExpr": "vals",
+  "DictExpr": "keys vals",
+  "SetExpr": "vals",
   "NumLit": "val",
   "BoolLit": "val",
   "StrLit": "val",
@@ -26,10 +28,26 @@ NODES = {
   "SetLine": "name expr",
   "IfLine": "cond_codes",
   "WhileLine": "cond line",
+  "ForLine": "name iter line",
   "FuncLine": "name arg_names line",
   "ReturnLine": "val",
   "Suite": "lines",
 }
 
+# fields filled in by the resolver once a line is parsed
+RESOLVED = {
+  "IdentExpr": "slot",
+  "SetLine": "slot",
+  "ForLine": "slot",
+  "FuncLine": "slot layout",
+  "DotExpr": "cache",
+  "ColonCallExpr": "cache",
+}
+
+# every node also has a pos field, the source index it starts at, which
+# the parser fills in for lines
 for name, fields in NODES.items():
-  globals()[name] = collections.namedtuple(name, fields)
\ No newline at end of file
+  extra = RESOLVED.get(name, "").split()
+  globals()[name] = collections.namedtuple(name,
+                                           fields.split() + extra + ["pos"],
+                                           defaults=[None] * (len(extra) + 1))
\ No newline at end of file
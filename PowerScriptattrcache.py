@@ -0,0 +1,82 @@
+import weakref
+
+from PowerScriptbaseobjects import PowerScriptError, builtin_meth, call
+
+# Every DotExpr and ColonCallExpr gets an AttrCache from the resolver, which
+# remembers where its attribute was found for the last few types of object
+# it was looked up on. An entry is only used while the attrs of its type
+# still have the version they had when it was made.
+
+# how many types one site keeps entries for before it stops adding more
+MAX_TYPES = 4
+
+# every AttrCache still in use, for stats()
+sites = weakref.WeakSet()
+
+class AttrCache():
+  """The attribute lookups of one DotExpr or ColonCallExpr.
+
+  An object's own attrs win over its type's, so only objects without any
+  use the entries, which are (type, version of its attrs, method) for
+  each type seen. method is (attr, builtin), where builtin says attr is a
+  builtin function callers may run without going through call.
+  """
+  __slots__ = ("name", "entries", "hits", "misses", "__weakref__")
+
+  def __init__(self, name):
+    self.name = name
+    self.entries = []
+    self.hits = 0
+    self.misses = 0
+    sites.add(self)
+
+  def __repr__(self):
+    return f"AttrCache({self.name!r})"
+
+  def lookup(self, val):
+    """Returns (attr, builtin) for the attribute of val."""
+    if not val.attrs:
+      obj_type = val.obj_type
+      version = obj_type.attrs.version
+      for entry in self.entries:
+        if entry[0] is obj_type and entry[1] == version:
+          self.hits += 1
+          return entry[2]
+    self.misses += 1
+    return self.fill(val)
+
+  def fill(self, val):
+    name = self.name
+    if name in val.attrs:
+      return (val.attrs[name], False)
+
+    obj_type = val.obj_type
+    type_attrs = obj_type.attrs
+    if name not in type_attrs:
+      raise PowerScriptError("Can't find attribute {}", name)
+    method = (type_attrs[name], builtin_meth(obj_type, name) is not None)
+
+    # the entry for an old version of the type's attrs is replaced
+    entries = [entry for entry in self.entries if entry[0] is not obj_type]
+    if len(entries) < MAX_TYPES:
+      entries.append((obj_type, type_attrs.version, method))
+    self.entries = entries
+    return method
+
+def call_method(env, method, args):
+  """Calls a method lookup returned, with args starting [attr, val]."""
+  func, builtin = method
+  if builtin:
+    return func.func(env, func, args)
+  return call(func, env, args)
+
+def stats():
+  """Returns the hit counts of every AttrCache still in use, added up."""
+  caches = list(sites)
+  return {
+    "sites": len(caches),
+    "hits": sum(cache.hits for cache in caches),
+    "misses": sum(cache.misses for cache in caches),
+    "polymorphic": sum(len(cache.entries) > 1 for cache in caches),
+    "full": sum(len(cache.entries) == MAX_TYPES for cache in caches),
+  }
@@ -1,18 +1,55 @@
+import itertools
+import types
+
 from util import is_int
 
 class PowerScriptError(RuntimeError):
-  pass
+  """An error raised while running PowerScript.
+
+  The message is only formatted with fmt_args when the error is shown,
+  so errors the interpreter raises and then recovers from stay cheap.
+  trace collects the position of the line that was running in each
+  frame the error passed through, innermost first.
+  """
+  def __init__(self, msg, *fmt_args):
+    super().__init__(msg, *fmt_args)
+    self.trace = []
+  
+  def add_frame(self, depth, source_map, pos):
+    if pos is None or source_map is None:
+      return
+    if self.trace and self.trace[-1][0] == depth:
+      return
+    self.trace.append((depth, source_map, pos))
+  
+  def __str__(self):
+    msg, *fmt_args = self.args
+    if fmt_args:
+      msg = msg.format(*fmt_args)
+    if self.trace:
+      msg += "\nPowerScript traceback (most recent call last):"
+      for _, source_map, pos in reversed(self.trace):
+        line_no, _ = source_map.line_pos(pos)
+        line = source_map.line_text(line_no).strip()
+        msg += f"\n  line {line_no}: {line}"
+    return msg
 
 ERR_TYPES = [
   "CallError",
   "MathError",
   "CompareError",
   "CastError",
+  "HashError",
+  "FileError",
+  "IterError",
 ]
 
 for type_name in ERR_TYPES:
   globals()[type_name] = type(type_name, (PowerScriptError,), {})
 
+def type_name(obj):
+  return getattr(obj.obj_type, "name", "object")
+
 # Object instance = object
 def make_spec_meth(name, var_name=None):
   if not var_name:
@@ -22,6 +59,7 @@ def make_spec_meth(name, var_name=None):
     meth = getattr(inst.obj_type, name)
     return meth(env, inst, args)
   
+  spec_meth.meth_name = name
   globals()[var_name] = spec_meth
   return spec_meth
 
@@ -32,6 +70,7 @@ SPEC_METHS = [
   "sub",
   "mul",
   "div",
+  "mod",
   ("pow", "pow_"),
   "neg",
 
@@ -55,6 +94,8 @@ SPEC_METHS = [
   ("num", "num_cast"),
   ("bool", "bool_cast"),
   ("string", "string_cast"),
+  ("hash", "hash_"),
+  ("iter", "iter_"),
 ]
 
 for meth in SPEC_METHS:
@@ -64,14 +105,58 @@ for meth in SPEC_METHS:
     make_spec_meth(meth)
 
 
+# every Attrs has a version no other Attrs has had, which changes with it
+attrs_versions = itertools.count()
+
+class Attrs(dict):
+  """The attrs of an Object.
+
+  Changing them empties dispatch_table and gives them a new version, so
+  caches of what they held can tell when they are stale.
+  """
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.version = next(attrs_versions)
+
+  def _changed(self):
+    self.version = next(attrs_versions)
+    dispatch_table.clear()
+
+  def __setitem__(self, key, val):
+    super().__setitem__(key, val)
+    self._changed()
+
+  def __delitem__(self, key):
+    super().__delitem__(key)
+    self._changed()
+
+  def _changes(name):
+    def meth(self, *args, **kwargs):
+      res = getattr(dict, name)(self, *args, **kwargs)
+      self._changed()
+      return res
+    meth.__name__ = name
+    return meth
+
+  update = _changes("update")
+  setdefault = _changes("setdefault")
+  pop = _changes("pop")
+  popitem = _changes("popitem")
+  clear = _changes("clear")
+
+  del _changes
+
+
 class Object(): # the object type class
   def __init__(self, obj_type, **kwargs):
     self.obj_type = obj_type
-    self.attrs = kwargs
+    self.attrs = Attrs(kwargs)
   
   def special_meth(name, err_str, err_type, right=None):
-    def meth(self, env, inst, args):
-      if name and name in self.attrs:
+    # left=False skips the left operand's method, for callers that have
+    # already called it
+    def meth(self, env, inst, args, left=True):
+      if left and name and name in self.attrs:
         func = self.attrs[name]
         res = func.obj_type.call(env, func,
                                   args)
@@ -89,7 +174,7 @@ class Object(): # the object type class
         if res is not PowerScript_notimpl:
           return res
 
-      raise err_type(err_str.format(args[0].obj_type.attrs))
+      raise err_type(err_str, *[type_name(arg) for arg in args[:2]])
 
     return meth
   
@@ -110,14 +195,14 @@ class Object(): # the object type class
 
   lshift = special_meth("__lshift", "Can't left shift {}",
                         MathError)
-  rshift = special_meth("__lshift", "Can't right shift {}",
+  rshift = special_meth("__rshift", "Can't right shift {}",
                         MathError)
-  and_ = special_meth("__and", "Can't & {} and {}", "__and",
-                      MathError)
-  or_ = special_meth("__or", "Can't | {} and {}", "__or",
-                     MathError)
-  xor = special_meth("__xor", "Can't ^ {} and {}", "__xor",
-                     MathError)
+  and_ = special_meth("__and", "Can't & {} and {}", MathError,
+                      "__and")
+  or_ = special_meth("__or", "Can't | {} and {}", MathError,
+                     "__or")
+  xor = special_meth("__xor", "Can't ^ {} and {}", MathError,
+                     "__xor")
   not_ = special_meth("__not", "Can't ~{}",
                       MathError)
 
@@ -147,10 +232,23 @@ class Object(): # the object type class
                       CastError)
   string = special_meth("__string", "Can't convert {} to string",
                         CastError)
+  hash = special_meth("__hash", "Can't hash {}", HashError)
+  iter = special_meth("__iter", "Can't iterate over {}", IterError)
 
   del special_meth
   
 
+class Value(): # the base of values of builtin types
+  """A value of a builtin type, which keeps only what that type needs.
+
+  Subclasses list their fields in __slots__ and set obj_type on the
+  class, so an instance has no __dict__. attrs is always empty: a value
+  that needs attributes of its own has to be an Object.
+  """
+  __slots__ = ()
+  attrs = types.MappingProxyType({})
+
+
 class Type(Object): # the type type class
   def __init__(self, *args, **kwargs):
     super().__init__(*args, **kwargs)
@@ -163,11 +261,14 @@ class Type(Object): # the type type class
 
 PowerScript_type = Type(None) 
 PowerScript_type.obj_type = PowerScript_type
+PowerScript_type.name = "type"
 PowerScript_object = Object(Type)
 
 PowerScript_notimpl_type = Object(PowerScript_type)
+PowerScript_notimpl_type.name = "notimpl"
 PowerScript_notimpl = Object(PowerScript_notimpl_type)
 PowerScript_none_type = Object(PowerScript_type)
+PowerScript_none_type.name = "none"
 PowerScript_none = Object(PowerScript_none_type)
 
 class BuiltinFuncType(Object):
@@ -200,6 +301,71 @@ class BuiltinFunc(Object):
 
 PowerScript_builtin = None # bootstrap the type for __new and init
 PowerScript_builtin = BuiltinFuncType(PowerScript_type)
+PowerScript_builtin.name = "builtin"
 PowerScript_builtin.attrs["__new"].obj_type = PowerScript_builtin
 PowerScript_builtin.attrs["__init"].obj_type = PowerScript_builtin
+
+# (attr, left type, right type) -> the builtin method a binary operation
+# on the two types runs first, or None if the left type has no builtin
+# method for it. Filled in as operations run, and emptied whenever the
+# attrs of any Object change.
+dispatch_table = {}
+
+def builtin_meth(obj_type, attr):
+  func = obj_type.attrs.get(attr)
+  if isinstance(func, BuiltinFunc) and func.obj_type is PowerScript_builtin:
+    return func
+  return None
+
+def make_fast_meth(var_name, attr):
+  """Makes a binary operation go through dispatch_table first.
+
+  The builtin method of the left operand's type is called straight away.
+  If there is none the operation falls back to the special_meth protocol,
+  and if it returns notimpl only the reflected half of that is left.
+  """
+  slow_meth = globals()[var_name]
+  meth_name = slow_meth.meth_name
+
+  def fast_meth(inst, env, args):
+    key = (attr, inst.obj_type, args[1].obj_type)
+    try:
+      func = dispatch_table[key]
+    except KeyError:
+      func = dispatch_table[key] = builtin_meth(inst.obj_type, attr)
+    if func is not None:
+      res = func.func(env, func, args)
+      if res is not PowerScript_notimpl:
+        return res
+      return getattr(inst.obj_type, meth_name)(env, inst, args, False)
+    return slow_meth(inst, env, args)
+
+  globals()[var_name] = fast_meth
+
+FAST_METHS = [
+  ("add", "__add"),
+  ("sub", "__sub"),
+  ("mul", "__mul"),
+  ("div", "__div"),
+  ("mod", "__mod"),
+  ("pow_", "__pow"),
+
+  ("lshift", "__lshift"),
+  ("rshift", "__rshift"),
+  ("and_", "__and"),
+  ("or_", "__or"),
+  ("xor", "__xor"),
+
+  ("contains", "__in"),
+
+  ("eq", "__eq"),
+  ("neq", "__neq"),
+  ("leq", "__leq"),
+  ("geq", "__geq"),
+  ("lt", "__lt"),
+  ("gt", "__gt"),
+]
+
+for var_name, attr in FAST_METHS:
+  make_fast_meth(var_name, attr)
 # finish bootstrapping
\ No newline at end of file
@@ -1,4 +1,6 @@
 from PowerScriptobjects import *
+from PowerScriptarray import make_array
+from PowerScriptfiles import open_file, stdin_lines, input_line
 
 builtins = {}
 
@@ -15,15 +17,38 @@ def builtin(name_=None):
     builtins[name] = BuiltinFunc(func)
   return deco
 
+def py_string(arg):
+  if arg.obj_type is PowerScript_string:
+    return arg.val
+  return make_string(arg).val
+
 @builtin("print")
 def _(env, _, args):
-  args = [make_string(arg).val for arg in args]
-  print("".join(args))
+  env.write("".join(map(py_string, args)) + "\n")
+
+@builtin("flush")
+def _(env, _, args):
+  env.flush()
+  return PowerScript_none
 
 @builtin("input")
 def _(env, _, args):
   args = [make_string(arg).val for arg in args]
-  return string_from_py_string(input("".join(args)))
+  # the prompt has to follow everything printed before it
+  env.flush()
+  return string_from_py_string(input_line("".join(args)))
+
+@builtin("open")
+def _(env, _, args):
+  if not 1 <= len(args) <= 2:
+    raise PowerScriptError("open takes a path and an optional mode")
+  path = make_string(args[0]).val
+  mode = make_string(args[1]).val if len(args) == 2 else "r"
+  return open_file(path, mode)
+
+@builtin("stdin_lines")
+def _(env, _, args):
+  return stdin_lines(env)
 
 @builtin("num")
 def _(env, _, args):
@@ -35,4 +60,69 @@ def _(env, _, args):
 
 @builtin("string")
 def _(env, _, args):
-  return make_string(*args)
\ No newline at end of file
+  return make_string(*args)
+
+@builtin("builder")
+def _(env, _, args):
+  return make_builder(*args)
+
+@builtin("range")
+def _(env, _, args):
+  return make_range(*args)
+
+@builtin("bytes")
+def _(env, _, args):
+  return make_bytes(*args)
+
+@builtin("dict")
+def _(env, _, args):
+  return make_dict(*args)
+
+@builtin("set")
+def _(env, _, args):
+  return make_set(*args)
+
+# array elements are NumPy numbers, so unlike nums, integer elements are
+# int64s that wrap around on overflow
+@builtin("array")
+def _(env, _, args):
+  return make_array(*args)
+
+def list_arg(args, ind, name):
+  if len(args) <= ind or args[ind].obj_type is not PowerScript_list:
+    raise PowerScriptError(f"{name} needs a list")
+  return args[ind].vals
+
+@builtin("map")
+def _(env, _, args):
+  if len(args) != 2:
+    raise PowerScriptError("map takes a function and a list")
+  vals = list_arg(args, 1, "map")
+  func = args[0]
+  return list_from_py_list([call(func, env, [func, val]) for val in vals])
+
+@builtin("filter")
+def _(env, _, args):
+  if len(args) != 2:
+    raise PowerScriptError("filter takes a function and a list")
+  vals = list_arg(args, 1, "filter")
+  func = args[0]
+  return list_from_py_list([val for val in vals
+                            if make_bool(call(func, env, [func, val])).val])
+
+@builtin("reduce")
+def _(env, _, args):
+  if not 2 <= len(args) <= 3:
+    raise PowerScriptError("reduce takes a function, a list and an optional "
+                           "start value")
+  vals = list_arg(args, 1, "reduce")
+  func = args[0]
+  if len(args) == 3:
+    total = args[2]
+  elif vals:
+    total, *vals = vals
+  else:
+    raise PowerScriptError("reduce of empty list with no start value")
+  for val in vals:
+    total = call(func, env, [func, total, val])
+  return total
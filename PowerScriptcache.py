@@ -0,0 +1,243 @@
+import collections
+import hashlib
+import marshal
+import os
+import struct
+
+import PowerScriptast as ast
+import PowerScriptparser as parser
+import PowerScripttokenizer as tokenizer
+from PowerScriptsourcemap import SourceMap, FileSourceMap
+from PowerScriptresolver import Resolver, builtin_names
+from PowerScriptattrcache import AttrCache
+
+# bump whenever parsing changes in a way that makes old ASTs wrong; changes
+# to the node fields are picked up by magic() on their own
+VERSION = 3
+
+NODE_TYPES = [getattr(ast, name) for name in ast.NODES] + [AttrCache]
+NODE_TAGS = {node_type: tag for tag, node_type in enumerate(NODE_TYPES)}
+
+_magic = None
+
+def magic():
+  """Returns the tag of ASTs this interpreter can run.
+
+  Names the resolver took for builtins are resolved differently, so the
+  builtin names are part of it. They are only loaded once everything is
+  imported, so it is worked out the first time it is needed.
+  """
+  global _magic
+  if _magic is None:
+    fields = (VERSION, ast.NODES, ast.RESOLVED, sorted(builtin_names()))
+    _magic = hashlib.blake2b(repr(fields).encode(), digest_size=4).digest()
+  return _magic
+
+# magic, source mtime in ns, source size in bytes, source hash
+HEADER = struct.Struct("<4sQQ16s")
+
+CACHE_DIR = "__pscache__"
+
+# total length of source the in-memory cache keeps parsed lines for
+MEMORY_CACHE_SIZE = 32 * 1024 * 1024
+
+# files bigger than this are streamed rather than parsed and cached
+MAX_CACHED_FILE = 8 * 1024 * 1024
+
+def source_hash(data):
+  return hashlib.blake2b(data, digest_size=16).digest()
+
+def encode(val):
+  """Turns an AST into nested tuples, lists and constants for marshal.
+
+  A node becomes a tuple starting with its tag. Plain tuples start with
+  None so they can be told apart. AttrCaches are written empty.
+  """
+  if isinstance(val, AttrCache):
+    return (NODE_TAGS[AttrCache], val.name)
+  elif isinstance(val, tuple):
+    tag = NODE_TAGS.get(type(val))
+    if tag is None:
+      return (None, *map(encode, val))
+    return (tag, *map(encode, val))
+  elif isinstance(val, list):
+    return [encode(item) for item in val]
+  else:
+    return val
+
+def decode(val):
+  if isinstance(val, tuple):
+    tag, *fields = val
+    fields = map(decode, fields)
+    if tag is None:
+      return tuple(fields)
+    return NODE_TYPES[tag](*fields)
+  elif isinstance(val, list):
+    return [decode(item) for item in val]
+  else:
+    return val
+
+def dumps(lines):
+  return marshal.dumps(encode((lines.global_names, list(lines))))
+
+def loads(data, size):
+  global_names, lines = decode(marshal.loads(data))
+  return CachedLines(lines, size, global_names)
+
+def cache_path(path):
+  head, tail = os.path.split(path)
+  name = os.path.splitext(tail)[0] + ".psc"
+  return os.path.join(head, CACHE_DIR, name)
+
+class ScriptCache():
+  """Parsed scripts, kept in memory and in .psc files next to scripts.
+
+  The in-memory tier maps a hash of the source to its parsed lines and
+  evicts the least recently used scripts once the total source length
+  passes max_size. The disk tier is only used for scripts run from a
+  file. Both are keyed on magic(), so an interpreter whose AST differs
+  never loads lines another one wrote.
+  """
+  def __init__(self, max_size=MEMORY_CACHE_SIZE):
+    self.max_size = max_size
+    self.size = 0
+    self.entries = collections.OrderedDict()
+    self.hits = 0
+    self.misses = 0
+    self.disk_hits = 0
+    self.disk_misses = 0
+
+  def stats(self):
+    return {
+      "hits": self.hits,
+      "misses": self.misses,
+      "disk_hits": self.disk_hits,
+      "disk_misses": self.disk_misses,
+      "entries": len(self.entries),
+      "size": self.size,
+    }
+
+  def clear(self):
+    self.entries.clear()
+    self.size = 0
+
+  def _get(self, key):
+    lines = self.entries.get(key)
+    if lines is None:
+      self.misses += 1
+    else:
+      self.hits += 1
+      self.entries.move_to_end(key)
+    return lines
+
+  def _put(self, key, lines, size):
+    if size > self.max_size:
+      return
+    self.entries[key] = lines
+    self.size += size
+    while self.size > self.max_size:
+      _, old_lines = self.entries.popitem(last=False)
+      self.size -= old_lines.size
+
+  def parse(self, code):
+    """Returns the parsed lines of a source string."""
+    key = (magic(), source_hash(code.encode()))
+    lines = self._get(key)
+    if lines is None:
+      resolver = Resolver()
+      lines = parser.parse(tokenizer.TokenStream(code), resolver=resolver)
+      lines = CachedLines(lines, len(code), resolver.global_names)
+      self._put(key, lines, lines.size)
+    return lines
+
+  def parse_file(self, path):
+    """Returns (lines, source map) for a script file.
+
+    lines is None if the file is too big to cache, in which case the
+    caller should stream it.
+    """
+    stat = os.stat(path)
+    if stat.st_size > MAX_CACHED_FILE:
+      return None, None
+
+    psc_path = cache_path(path)
+    psc = self._read_psc(psc_path)
+    if psc is not None:
+      mtime_ns, size, digest, payload = psc
+      if mtime_ns == stat.st_mtime_ns and size == stat.st_size:
+        lines = self._load(digest, payload, size)
+        if lines is not None:
+          self.disk_hits += 1
+          return lines, FileSourceMap(path)
+
+    with open(path, "rb") as f:
+      data = f.read()
+    code = data.decode()
+    digest = source_hash(data)
+    lines = None
+    if psc is not None and psc[2] == digest:
+      # only the mtime changed, so the lines on disk are still good
+      lines = self._load(digest, psc[3], len(data))
+    if lines is not None:
+      self.disk_hits += 1
+    else:
+      self.disk_misses += 1
+      lines = self.parse(code)
+    self._write_psc(psc_path, stat, digest, lines)
+    return lines, SourceMap(code)
+
+  def _load(self, digest, payload, size):
+    """Returns the lines in a .psc payload, or None if it is corrupt."""
+    key = (magic(), digest)
+    lines = self._get(key)
+    if lines is None:
+      try:
+        lines = loads(payload, size)
+      except Exception:
+        return None
+      self._put(key, lines, size)
+    return lines
+
+  def _read_psc(self, psc_path):
+    """Returns (mtime_ns, size, source hash, payload) from a .psc file.
+
+    Returns None if there is no such file or another interpreter wrote it.
+    """
+    try:
+      with open(psc_path, "rb") as f:
+        data = f.read()
+    except OSError:
+      return None
+    if len(data) < HEADER.size:
+      return None
+    tag, mtime_ns, size, digest = HEADER.unpack_from(data)
+    if tag != magic():
+      return None
+    return mtime_ns, size, digest, data[HEADER.size:]
+
+  def _write_psc(self, psc_path, stat, digest, lines):
+    header = HEADER.pack(magic(), stat.st_mtime_ns, stat.st_size, digest)
+    tmp_path = f"{psc_path}.{os.getpid()}.tmp"
+    try:
+      os.makedirs(os.path.dirname(psc_path), exist_ok=True)
+      with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(dumps(lines))
+      os.replace(tmp_path, psc_path)
+    except OSError:
+      pass
+
+class CachedLines(list):
+  """Parsed top level lines, with the length of their source.
+
+  global_names are the names of the global frame's slots. compiled maps
+  an engine name to what that engine compiled the lines to, so it is
+  only done once per cached script.
+  """
+  def __init__(self, lines, size, global_names):
+    super().__init__(lines)
+    self.size = size
+    self.global_names = global_names
+    self.compiled = {}
+
+cache = ScriptCache()
@@ -0,0 +1,308 @@
+import PowerScriptast as ast
+import PowerScriptobjects as objs
+import PowerScriptexec
+from PowerScriptresolver import UNBOUND
+from PowerScriptattrcache import call_method
+from PowerScriptexec import RETURN
+
+# Every node is compiled once to a Python closure that runs it. Expression
+# closures take env and return the value; line closures take env and
+# return RETURN if a return line ran, like exec_line. Which closure to
+# build is decided at compile time, so running one never looks at node
+# types or operator names.
+
+def compile_expr(expr):
+  if isinstance(expr, ast.IdentExpr):
+    name = expr.ident
+    slot = expr.slot
+    if slot is None:
+      def run_builtin(env):
+        return env.get_var(name, None)
+      return run_builtin
+
+    local, _, cell = slot
+    if cell:
+      def run_cell(env):
+        val = env.stack[-1][local].val
+        if val is UNBOUND:
+          return env.get_var(name, slot)
+        return val
+      return run_cell
+
+    def run_ident(env):
+      val = env.stack[-1][local]
+      if val is UNBOUND:
+        return env.get_var(name, slot)
+      return val
+    return run_ident
+
+  elif isinstance(expr, ast.NumLit):
+    # literals are never mutated, so every evaluation shares one object
+    val = objs.num_from_py_num(expr.val)
+    return lambda env: val
+
+  elif isinstance(expr, ast.BinExpr):
+    left = compile_expr(expr.left)
+    right = compile_expr(expr.right)
+    make_bool = objs.make_bool
+    if expr.op == "BOOLAND":
+      def run_and(env):
+        lval = left(env)
+        if make_bool(lval).val:
+          return right(env)
+        return lval
+      return run_and
+
+    elif expr.op == "BOOLOR":
+      def run_or(env):
+        lval = left(env)
+        if make_bool(lval).val:
+          return lval
+        return right(env)
+      return run_or
+
+    func = PowerScriptexec.BIN_OPS[expr.op]
+    def run_bin(env):
+      lval = left(env)
+      rval = right(env)
+      return func(lval, env, [lval, rval])
+    return run_bin
+
+  elif isinstance(expr, ast.CmpExpr):
+    vals = [compile_expr(val) for val in expr.vals]
+    funcs = [PowerScriptexec.CMP_OPS[op] for op in expr.ops]
+    make_bool = objs.make_bool
+    true = objs.bool_from_py_bool(True)
+    false = objs.bool_from_py_bool(False)
+    if len(funcs) == 1:
+      func = funcs[0]
+      left, right = vals
+      def run_cmp(env):
+        lval = left(env)
+        rval = right(env)
+        if make_bool(func(lval, env, [lval, rval])).val:
+          return true
+        return false
+      return run_cmp
+
+    pairs = list(zip(funcs, range(len(funcs))))
+    def run_chain(env):
+      cmp_vals = [val(env) for val in vals]
+      for func, ind in pairs:
+        lval = cmp_vals[ind]
+        rval = cmp_vals[ind + 1]
+        if not make_bool(func(lval, env, [lval, rval])).val:
+          return false
+      return true
+    return run_chain
+
+  elif isinstance(expr, ast.CallExpr):
+    args = [compile_expr(arg) for arg in expr.args]
+    func_expr = compile_expr(expr.func)
+    call = objs.call
+    def run_call(env):
+      arg_vals = [arg(env) for arg in args]
+      func = func_expr(env)
+      return call(func, env, [func] + arg_vals)
+    return run_call
+
+  elif isinstance(expr, ast.ColonCallExpr):
+    val_expr = compile_expr(expr.expr)
+    args = [compile_expr(arg) for arg in expr.args]
+    lookup = expr.cache.lookup
+    def run_colon_call(env):
+      val = val_expr(env)
+      method = lookup(val)
+      call_args = [method[0], val]
+      for arg in args:
+        call_args.append(arg(env))
+      return call_method(env, method, call_args)
+    return run_colon_call
+
+  elif isinstance(expr, ast.UnaryExpr):
+    val_expr = compile_expr(expr.val)
+    func = PowerScriptexec.UNARY_OPS[expr.op]
+    def run_unary(env):
+      val = val_expr(env)
+      return func(val, env, [val])
+    return run_unary
+
+  elif isinstance(expr, ast.DotExpr):
+    val_expr = compile_expr(expr.val)
+    lookup = expr.cache.lookup
+    def run_dot(env):
+      return lookup(val_expr(env))[0]
+    return run_dot
+
+  elif isinstance(expr, ast.ListExpr):
+    elems = [compile_expr(elem) for elem in expr.vals]
+    list_from_py_list = objs.list_from_py_list
+    def run_list(env):
+      return list_from_py_list([elem(env) for elem in elems])
+    return run_list
+
+  elif isinstance(expr, ast.DictExpr):
+    items = [(compile_expr(key), compile_expr(val))
+             for key, val in zip(expr.keys, expr.vals)]
+    dict_from_py_pairs = objs.dict_from_py_pairs
+    def run_dict(env):
+      return dict_from_py_pairs(env, [(key(env), val(env))
+                                      for key, val in items])
+    return run_dict
+
+  elif isinstance(expr, ast.SetExpr):
+    elems = [compile_expr(elem) for elem in expr.vals]
+    set_from_py_list = objs.set_from_py_list
+    def run_set(env):
+      return set_from_py_list(env, [elem(env) for elem in elems])
+    return run_set
+
+  elif isinstance(expr, ast.BoolLit):
+    val = objs.bool_from_py_bool(expr.val)
+    return lambda env: val
+
+  elif isinstance(expr, ast.StrLit):
+    val = objs.string_from_py_string(expr.val)
+    return lambda env: val
+
+  else:
+    raise TypeError(f"Unknown expr type {type(expr)}")
+
+def compile_line(line):
+  """Compiles a line, adding its position to errors raised while it runs."""
+  run = _compile_line(line)
+  pos = line.pos
+  if pos is None or isinstance(line, ast.Suite):
+    return run
+
+  def run_line(env):
+    try:
+      return run(env)
+    except objs.PowerScriptError as err:
+      err.add_frame(len(env.stack), env.source_map, pos)
+      raise
+  return run_line
+
+def _compile_line(line):
+  if isinstance(line, ast.ExprLine):
+    return compile_expr(line.expr)
+
+  elif isinstance(line, ast.SetLine):
+    name = line.name
+    slot = line.slot
+    val_expr = compile_expr(line.expr)
+    if slot is None or slot[2]:
+      def run_set_var(env):
+        env.set_var(name, slot, val_expr(env))
+      return run_set_var
+
+    local = slot[0]
+    def run_set(env):
+      val = val_expr(env)
+      frame = env.stack[-1]
+      if frame[local] is UNBOUND:
+        env.set_var(name, slot, val)
+      else:
+        frame[local] = val
+    return run_set
+
+  elif isinstance(line, ast.IfLine):
+    make_bool = objs.make_bool
+    clauses = [(compile_expr(cond), compile_line(stmt))
+               for cond, stmt in line.cond_codes]
+    def run_if(env):
+      for cond, stmt in clauses:
+        if make_bool(cond(env)).val:
+          return stmt(env)
+    return run_if
+
+  elif isinstance(line, ast.WhileLine):
+    make_bool = objs.make_bool
+    cond = compile_expr(line.cond)
+    body = compile_line(line.line)
+    def run_while(env):
+      while make_bool(cond(env)).val:
+        if body(env) is RETURN:
+          return RETURN
+    return run_while
+
+  elif isinstance(line, ast.ForLine):
+    name = line.name
+    slot = line.slot
+    iter_expr = compile_expr(line.iter)
+    body = compile_line(line.line)
+    py_iter = objs.py_iter
+    # a local slot is set like run_set does, other names with set_var
+    local = None if slot is None or slot[2] else slot[0]
+    def run_for(env):
+      frame = env.stack[-1]
+      for val in py_iter(env, iter_expr(env)):
+        if local is None or frame[local] is UNBOUND:
+          env.set_var(name, slot, val)
+        else:
+          frame[local] = val
+        if body(env) is RETURN:
+          return RETURN
+    return run_for
+
+  elif isinstance(line, ast.FuncLine):
+    name = line.name
+    slot = line.slot
+    arg_names = line.arg_names
+    layout = line.layout
+    body = compile_line(line.line)
+    make_func = objs.make_func
+    def run_func_def(env):
+      func = make_func(arg_names, layout, env.stack[-1], body, run_body)
+      env.set_var(name, slot, func)
+    return run_func_def
+
+  elif isinstance(line, ast.ReturnLine):
+    val_expr = compile_expr(line.val)
+    def run_return(env):
+      env.ret_stack[-1] = val_expr(env)
+      return RETURN
+    return run_return
+
+  elif isinstance(line, ast.Suite):
+    return compile_suite(line.lines)
+
+  else:
+    raise TypeError(f"Unknown line type {type(line)}")
+
+def compile_suite(lines):
+  runs = [compile_line(line) for line in lines]
+  if len(runs) == 1:
+    return runs[0]
+  def run_suite(env):
+    for run in runs:
+      if run(env) is RETURN:
+        return RETURN
+  return run_suite
+
+def run_body(env, body):
+  body(env)
+
+def exec_suite(env, lines):
+  """Runs top level lines, compiling them to closures first.
+
+  As with the VM, the closures of cached lines are kept with them and
+  streamed lines are compiled one at a time.
+  """
+  if not isinstance(lines, list):
+    for line in lines:
+      if compile_line(line)(env) is RETURN:
+        break
+    return
+
+  compiled = getattr(lines, "compiled", None)
+  if compiled is None:
+    compile_suite(lines)(env)
+    return
+
+  run = compiled.get("closure")
+  if run is None:
+    run = compiled["closure"] = compile_suite(lines)
+  run(env)
+
+PowerScriptexec.ENGINES["closure"] = exec_suite
@@ -1,54 +1,98 @@
+import sys
+
 from PowerScriptobjects import PowerScriptError, PowerScript_none
 from PowerScriptbuiltins import builtins
+from PowerScriptresolver import UNBOUND
+
+# how many characters of printed text an Env keeps before writing them
+OUT_BUFFER_SIZE = 64 * 1024
 
 class Env():
-  def __init__(self, builtins=builtins):
+  def __init__(self, builtins=builtins, out=None,
+               buffer_size=OUT_BUFFER_SIZE):
+    # frames are lists of slot values, the first is the global frame
     self.stack = [[]]
     self.ret_stack = [None]
     self.builtins = builtins
-  
-  def find_in_frame(self, frame, name):
-    for scope in reversed(frame):
-      if name in scope:
-        return scope
-    raise NameError()
-
-  def _get_dict(self, name):
-    if name in self.builtins:
-      return self.builtins
-    
-    try:
-      return self.find_in_frame(self.stack[-1], name)
-    except NameError:
-      pass
-
-    try:
-      return self.find_in_frame(self.stack[0], name)
-    except NameError:
-      pass
-    
-    raise PowerScriptError(f"Variable {name} not found")
-  
-  def get_var(self, name):
-    return self._get_dict(name)[name]
-  
-  def set_var(self, name, val):
-    try:
-      self._get_dict(name)[name] = val
-    except PowerScriptError:
-      self.stack[-1][-1][name] = val
-  
-  def add_frame(self, scopes):
-    self.stack.append(list(scopes))
+    self.source_map = None
+    # printed text is written to out, or to sys.stdout as it is when the
+    # text is written if out is None
+    self.out = out
+    self.buffer_size = buffer_size
+    self.out_parts = []
+    self.out_len = 0
+
+  def write(self, text):
+    """Prints text, once buffer_size characters have been printed."""
+    self.out_parts.append(text)
+    self.out_len += len(text)
+    if self.out_len >= self.buffer_size:
+      self.flush()
+
+  def flush(self):
+    """Writes out everything printed so far."""
+    out = sys.stdout if self.out is None else self.out
+    if self.out_parts:
+      out.write("".join(self.out_parts))
+      self.out_parts.clear()
+      self.out_len = 0
+    out.flush()
+
+  def get_var(self, name, slot):
+    """Returns the value of a name at slot, as given by the resolver.
+
+    A name with no value in the current frame is looked up in the global
+    frame, which has changed since the frame was made if a function
+    outlived the call it was defined in, and then in the builtins. The
+    resolver only knows the default builtins, so names an Env's own
+    builtins add get a slot that is never set.
+    """
+    if slot is None:
+      try:
+        return self.builtins[name]
+      except KeyError:
+        raise PowerScriptError("Variable {} not found", name) from None
+
+    local, glob, cell = slot
+    val = self.stack[-1][local]
+    if cell:
+      val = val.val
+    if val is UNBOUND:
+      val = self.stack[0][glob]
+      if val is UNBOUND:
+        val = self.builtins.get(name, UNBOUND)
+        if val is UNBOUND:
+          raise PowerScriptError("Variable {} not found", name)
+    return val
+
+  def set_var(self, name, slot, val):
+    if slot is None:
+      self.builtins[name] = val
+      return
+
+    local, glob, cell = slot
+    frame = self.stack[-1]
+    if cell:
+      cell = frame[local]
+      if cell.val is UNBOUND and self.stack[0][glob] is not UNBOUND:
+        self.stack[0][glob] = val
+      else:
+        cell.val = val
+    elif frame[local] is UNBOUND and self.stack[0][glob] is not UNBOUND:
+      self.stack[0][glob] = val
+    else:
+      frame[local] = val
+
+  def add_globals(self, count):
+    """Makes room in the global frame for up to count globals."""
+    frame = self.stack[0]
+    if len(frame) < count:
+      frame.extend([UNBOUND] * (count - len(frame)))
+
+  def add_frame(self, frame):
+    self.stack.append(frame)
     self.ret_stack.append(PowerScript_none)
-  
-  def add_scopes(self, scopes):
-    self.stack[-1].extend(scopes)
-  
-  def remove_scope(self, count=1):
-    for _ in range(count):
-      self.stack[-1].pop()
-  
+
   def remove_frame(self):
     self.stack.pop()
-    return self.ret_stack.pop()
\ No newline at end of file
+    return self.ret_stack.pop()
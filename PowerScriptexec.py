@@ -2,6 +2,10 @@ import PowerScriptast as ast
 import PowerScriptobjects as objs
 import PowerScripttokenizer as tokenizer
 import PowerScriptparser as parser
+import PowerScriptcache as scriptcache
+from PowerScriptsourcemap import SourceMap
+from PowerScriptresolver import Resolver
+from PowerScriptattrcache import call_method
 
 def bool_not(env, _, args):
   arg = args[0]
@@ -15,7 +19,7 @@ UNARY_OPS = {
 }
 
 POW = {"POW"}
-MUL_DIV = {"MUL", "DIV"}
+MUL_DIV = {"MUL", "DIV", "MOD"}
 ADD_SUB = {"ADD", "SUB"}
 SHIFT = {"LSHIFT", "RSHIFT"}
 BIN = {"AND", "OR", "XOR"}
@@ -26,6 +30,7 @@ BIN_OPS = {
   "POW": objs.pow_,
   "MUL": objs.mul,
   "DIV": objs.div,
+  "MOD": objs.mod,
   "ADD": objs.add,
   "SUB": objs.sub,
   "LSHIFT": objs.lshift,
@@ -83,14 +88,7 @@ def eval_expr(env, expr):
   
   elif isinstance(expr, ast.DotExpr):
     val = eval_expr(env, expr.val)
-    if expr.name in val.attrs:
-      res = val.attrs[expr.name]
-    elif expr.name in val.obj_type.attrs:
-      res = val.obj_type.attrs[expr.name]
-    else:
-      raise objs.PowerScriptError(f"Can't find attribute {expr.name}")
-      
-    return res
+    return expr.cache.lookup(val)[0]
 
   elif isinstance(expr, ast.CallExpr):
     args = [eval_expr(env, arg) for arg in expr.args]
@@ -99,24 +97,28 @@ def eval_expr(env, expr):
   
   elif isinstance(expr, ast.ColonCallExpr):
     expr_val = eval_expr(env, expr.expr)
-
-    if expr.name in expr_val.attrs:
-      func = expr_val.attrs[expr.name]
-    elif expr.name in expr_val.obj_type.attrs:
-      func = expr_val.obj_type.attrs[expr.name]
-    else:
-      raise obs.PowerScriptError(f"Can't find attribute {expr.name}")
-
-    args = [eval_expr(env, arg) for arg in expr.args]
-    return objs.call(func, env, [func, expr_val] + args)
+    method = expr.cache.lookup(expr_val)
+    args = [method[0], expr_val]
+    for arg in expr.args:
+      args.append(eval_expr(env, arg))
+    return call_method(env, method, args)
   
   elif isinstance(expr, ast.IdentExpr):
-    return env.get_var(expr.ident)
+    return env.get_var(expr.ident, expr.slot)
   
   elif isinstance(expr, ast.ListExpr):
     elems = [eval_expr(env, elem) for elem in expr.vals]
     return objs.list_from_py_list(elems)
   
+  elif isinstance(expr, ast.DictExpr):
+    pairs = [(eval_expr(env, key), eval_expr(env, val))
+             for key, val in zip(expr.keys, expr.vals)]
+    return objs.dict_from_py_pairs(env, pairs)
+  
+  elif isinstance(expr, ast.SetExpr):
+    elems = [eval_expr(env, elem) for elem in expr.vals]
+    return objs.set_from_py_list(env, elems)
+  
   elif isinstance(expr, ast.NumLit):
     return objs.num_from_py_num(expr.val)
   
@@ -129,48 +131,147 @@ def eval_expr(env, expr):
   else:
     raise TypeError(f"Unknown expr type {type(expr)}")
 
+class Status():
+  def __init__(self, name):
+    self.name = name
+
+  def __repr__(self):
+    return self.name
+
+# Running a line returns RETURN once a return line in it has run, which
+# every line around it passes on without running anything more, up to
+# the function call or the top level. Otherwise it returns anything else.
+RETURN = Status("RETURN")
+
 def exec_line(env, line):
-  if isinstance(line, ast.ExprLine):
-    eval_expr(env, line.expr)
+  try:
+    if isinstance(line, ast.ExprLine):
+      eval_expr(env, line.expr)
     
-  elif isinstance(line, ast.SetLine):
-    env.set_var(line.name, eval_expr(env, line.expr))
-
-  elif isinstance(line, ast.IfLine):
-    for cond, stmt in line.cond_codes:
-      if objs.make_bool(eval_expr(env, cond)).val:
-        exec_line(env, stmt)
-        break
+    elif isinstance(line, ast.SetLine):
+      env.set_var(line.name, line.slot, eval_expr(env, line.expr))
+
+    elif isinstance(line, ast.IfLine):
+      for cond, stmt in line.cond_codes:
+        if objs.make_bool(eval_expr(env, cond)).val:
+          return exec_line(env, stmt)
   
-  elif isinstance(line, ast.WhileLine):
-    while objs.make_bool(eval_expr(env, line.cond)).val:
-      exec_line(env, line.line)
+    elif isinstance(line, ast.WhileLine):
+      while objs.make_bool(eval_expr(env, line.cond)).val:
+        if exec_line(env, line.line) is RETURN:
+          return RETURN
   
-  elif isinstance(line, ast.FuncLine):
-    func = objs.make_func(line.arg_names,
-                          env.stack[-1],
-                          line.line)
-    env.set_var(line.name, func)
+    elif isinstance(line, ast.ForLine):
+      for val in objs.py_iter(env, eval_expr(env, line.iter)):
+        env.set_var(line.name, line.slot, val)
+        if exec_line(env, line.line) is RETURN:
+          return RETURN
   
-  elif isinstance(line, ast.ReturnLine):
-    res = eval_expr(env, line.val)
-    env.ret_stack[-1] = res
+    elif isinstance(line, ast.FuncLine):
+      func = objs.make_func(line.arg_names,
+                            line.layout,
+                            env.stack[-1],
+                            line.line)
+      env.set_var(line.name, line.slot, func)
+  
+    elif isinstance(line, ast.ReturnLine):
+      res = eval_expr(env, line.val)
+      env.ret_stack[-1] = res
+      return RETURN
 
-  elif isinstance(line, ast.Suite):
-    exec_suite(env, line.lines)
+    elif isinstance(line, ast.Suite):
+      return exec_suite(env, line.lines)
   
-  else:
-    raise TypeError(f"Unknown line type {type(line)}")
+    else:
+      raise TypeError(f"Unknown line type {type(line)}")
+  except objs.PowerScriptError as err:
+    err.add_frame(len(env.stack), env.source_map, line.pos)
+    raise
 
 def exec_suite(env, lines):
   for line in lines:
-    exec_line(env, line)
+    if exec_line(env, line) is RETURN:
+      return RETURN
+
+def grow_globals(env, lines, global_names):
+  """Yields streamed lines, first making room for the globals they add."""
+  for line in lines:
+    env.add_globals(len(global_names))
+    yield line
+
+def run_lines(env, lines, source_map, global_names, engine="tree"):
+  """Runs lines in a new global frame with a slot for each global name.
+
+  global_names may grow while lines is iterated over.
+  """
+  exec_lines = ENGINES[engine]
+  old_globals = env.stack[0]
+  env.stack[0] = []
+  env.add_globals(len(global_names))
+  if not isinstance(lines, list):
+    lines = grow_globals(env, lines, global_names)
+  old_source_map = env.source_map
+  env.source_map = source_map
+  try:
+    exec_lines(env, lines)
+  finally:
+    env.flush()
+    env.source_map = old_source_map
+    env.stack[0] = old_globals
+
+def run_code(env, code, engine="tree", cache=scriptcache.cache):
+  """Runs PowerScript source in env.
+
+  code is either a string, which is parsed completely before it runs, or
+  a file object or other iterable of string chunks, whose lines run as
+  soon as they are parsed so that memory use does not grow with the
+  length of the script. Parsed strings are kept in cache unless it is
+  None. engine names one of ENGINES to run the lines with.
+
+  A streamed script is not checked for syntax errors before it starts,
+  so the lines before a syntax error have already run when it is
+  raised. A string with a syntax error runs nothing.
+  """
+  if isinstance(code, str):
+    if cache is None:
+      resolver = Resolver()
+      lines = parser.parse(tokenizer.TokenStream(code), resolver=resolver)
+      global_names = resolver.global_names
+    else:
+      lines = cache.parse(code)
+      global_names = lines.global_names
+    run_lines(env, lines, SourceMap(code), global_names, engine)
+  else:
+    toks = tokenizer.TokenStream(code)
+    resolver = Resolver()
+    lines = parser.iter_parse(toks, resolver=resolver)
+    run_lines(env, lines, toks.source_map, resolver.global_names, engine)
+
+def run_file(env, path, engine="tree", cache=scriptcache.cache):
+  """Runs a PowerScript file in env.
+
+  The parsed file is kept in cache and in a .psc file, so later runs
+  skip parsing until the file changes. Files too big for the cache are
+  streamed like run_code does for file objects, so the lines before a
+  syntax error in one of them run before the error is raised.
+  """
+  lines = source_map = None
+  if cache is not None:
+    lines, source_map = cache.parse_file(path)
+  if lines is not None:
+    run_lines(env, lines, source_map, lines.global_names, engine)
+  else:
+    with open(path) as f:
+      run_code(env, f, engine)
+
+# how run_code can execute lines; each takes (env, lines). Other engines
+# add themselves when imported below.
+ENGINES = {
+  "tree": exec_suite,
+}
 
-def run_code(env, code):
-  env.add_scopes([{}])
-  toks = tokenizer.TokenStream(code)
-  lines = parser.parse(toks)
-  exec_suite(env, lines)
-  env.remove_scope()
+import PowerScriptvm
+import PowerScriptclosures
+import PowerScripttranspiler
 
-__all__ = ["run_code"]
\ No newline at end of file
+__all__ = ["run_code", "run_file"]
@@ -0,0 +1,221 @@
+import itertools
+import mmap
+import os
+import sys
+
+from PowerScriptobjects import *
+
+# Files are always opened in binary mode and decoded as UTF-8 by PowerScript,
+# so reading text and reading bytes work the same on any file. Files at
+# least MMAP_MIN long are mapped rather than read, so going through their
+# lines only keeps the pages in use in memory, and readbytes on them
+# copies nothing.
+
+MMAP_MIN = 1024 * 1024
+
+MODES = {"r": "rb", "w": "wb", "a": "ab"}
+
+def strip_newline(line):
+  if line.endswith("\n"):
+    line = line[:-1]
+    if line.endswith("\r"):
+      line = line[:-1]
+  return line
+
+def decode_line(line):
+  try:
+    return strip_newline(line.decode())
+  except UnicodeDecodeError as err:
+    raise FileError("Can't decode line: {}", err.reason) from None
+
+def decoded_lines(lines):
+  """Yields the lines of an iterable of binary lines, as Python strings."""
+  for line in lines:
+    yield decode_line(line)
+
+def py_string(arg, env):
+  if arg.obj_type is not PowerScript_string:
+    arg = string_cast(arg, env, [arg])
+  return arg.val
+
+def open_file(path, mode):
+  if mode not in MODES:
+    raise FileError("Unknown file mode {}", mode)
+  try:
+    file = open(path, MODES[mode])
+    mapped = None
+    if mode == "r" and os.fstat(file.fileno()).st_size >= MMAP_MIN:
+      mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+  except OSError as err:
+    raise FileError("Can't open {}: {}", path, err.strerror) from None
+  return FileValue(file, mapped, mode)
+
+def reader(obj):
+  """Returns what to read obj from: its map, or else the file itself."""
+  if obj.file.closed:
+    raise FileError("File is closed")
+  if obj.mode != "r":
+    raise FileError("File is not open for reading")
+  return obj.mapped if obj.mapped is not None else obj.file
+
+def read_file(env, _, args):
+  try:
+    return string_from_py_string(reader(args[1]).read().decode())
+  except UnicodeDecodeError as err:
+    raise FileError("Can't decode file: {}", err.reason) from None
+
+def readbytes_file(env, _, args):
+  obj = args[1]
+  source = reader(obj)
+  if source is obj.mapped:
+    start = source.tell()
+    source.seek(0, os.SEEK_END)
+    return BytesValue(source, start, source.tell())
+  data = source.read()
+  return BytesValue(data, 0, len(data))
+
+def lines_file(env, _, args):
+  source = reader(args[1])
+  if source is args[1].mapped:
+    return LinesValue(decoded_lines(iter(source.readline, b"")), args[1])
+  return LinesValue(decoded_lines(source), args[1])
+
+def write_file(env, _, args):
+  obj = args[1]
+  if obj.file.closed:
+    raise FileError("File is closed")
+  if obj.mode == "r":
+    raise FileError("File is not open for writing")
+  for arg in args[2:]:
+    obj.file.write(py_string(arg, env).encode())
+  return PowerScript_none
+
+def close_file(env, _, args):
+  obj = args[1]
+  # bytes read from the map may still use it, so it is left to close
+  # once they are gone
+  obj.mapped = None
+  obj.file.close()
+  return PowerScript_none
+
+file_attrs = {
+  "read": BuiltinFunc(read_file),
+  "readbytes": BuiltinFunc(readbytes_file),
+  "lines": BuiltinFunc(lines_file),
+  "write": BuiltinFunc(write_file),
+  "close": BuiltinFunc(close_file),
+}
+
+PowerScript_file = Object(PowerScript_type, **file_attrs)
+PowerScript_file.name = "file"
+
+class FileValue(Value):
+  """An open file, and its map if it is big and open for reading."""
+  __slots__ = ("file", "mapped", "mode")
+  obj_type = PowerScript_file
+
+  def __init__(self, file, mapped, mode):
+    self.file = file
+    self.mapped = mapped
+    self.mode = mode
+
+
+def check_open(obj):
+  """Raises FileError if obj's file has been closed."""
+  if obj.file is not None and obj.file.file.closed:
+    raise FileError("File is closed")
+
+def open_lines(obj, lines):
+  """Yields lines, checking obj's file is still open before each one."""
+  while True:
+    check_open(obj)
+    line = next(lines, None)
+    if line is None:
+      return
+    yield line
+
+def next_line(obj):
+  """Returns the next line of obj as a Python string, or None at the end."""
+  check_open(obj)
+  line = obj.ahead
+  if line is not None:
+    obj.ahead = None
+    return line
+  return next(obj.lines, None)
+
+def next_lines(env, _, args):
+  line = next_line(args[1])
+  if line is None:
+    raise FileError("No more lines")
+  return string_from_py_string(line)
+
+def done_lines(env, _, args):
+  obj = args[1]
+  check_open(obj)
+  if obj.ahead is None:
+    obj.ahead = next(obj.lines, None)
+  return bool_from_py_bool(obj.ahead is None)
+
+def __iter_lines(env, _, args):
+  obj = args[0]
+  check_open(obj)
+  lines = obj.lines
+  if obj.ahead is not None:
+    lines = itertools.chain([next_line(obj)], lines)
+  if obj.file is not None:
+    lines = open_lines(obj, lines)
+  return IterValue(map(string_from_py_string, lines))
+
+lines_attrs = {
+  "__iter": BuiltinFunc(__iter_lines),
+
+  "next": BuiltinFunc(next_lines),
+  "done": BuiltinFunc(done_lines),
+}
+
+PowerScript_lines = Object(PowerScript_type, **lines_attrs)
+PowerScript_lines.name = "lines"
+
+class LinesValue(Value):
+  """The lines of a file, read one at a time without their newlines.
+
+  lines is an iterator of Python strings, read from file unless it is
+  None. done has to read a line to know if there is one, and keeps it in
+  ahead for next.
+  """
+  __slots__ = ("lines", "file", "ahead")
+  obj_type = PowerScript_lines
+
+  def __init__(self, lines, file=None):
+    self.lines = lines
+    self.file = file
+    self.ahead = None
+
+# stdin is read from its binary buffer like files are, so input has to
+# read from it too, or lines sys.stdin reads ahead would be lost. A
+# terminal gives one line per read, so there input keeps line editing.
+
+def flushed_lines(env, lines):
+  """Yields lines, flushing env's output before reading each one."""
+  while True:
+    # a prompt printed before the read has to be shown, and with nothing
+    # printed since the last flush there is nothing to show
+    if env.out_parts:
+      env.flush()
+    line = next(lines, None)
+    if line is None:
+      return
+    yield line
+
+def stdin_lines(env):
+  return LinesValue(flushed_lines(env, decoded_lines(sys.stdin.buffer)))
+
+def input_line(prompt):
+  if sys.stdin.isatty():
+    return input(prompt)
+  sys.stdout.write(prompt)
+  sys.stdout.flush()
+  line = sys.stdin.buffer.readline()
+  if not line:
+    raise EOFError
+  return decode_line(line)
@@ -1,11 +1,12 @@
 from PowerScriptbaseobjects import *
 import PowerScriptexec
+from PowerScriptresolver import Cell
 
 def make_empty_obj(type_, **attrs):
   return Object(type_, **attrs)
 
 def __new_num(env, _, args):
-  return make_empty_obj(PowerScript_num)
+  return NumValue(0)
 
 def __init_num(env, _, args):
   obj, *args = args
@@ -52,7 +53,7 @@ def __mod_num(env, _, args):
   if args[1].obj_type is PowerScript_num:
     if args[1].val == 0:
       raise PowerScriptError("Modulo by 0")
-    return num_from_py_num(args[0].val / args[1].val)
+    return num_from_py_num(args[0].val % args[1].val)
   else:
     return PowerScript_notimpl
 
@@ -71,7 +72,7 @@ def to_int(num):
   if is_int(num.val):
     return int(num.val)
   else:
-    raise PowerScriptError(f"Cannot convert {num.val} to integer")
+    raise PowerScriptError("Cannot convert {} to integer", num.val)
 
 def shift(num, sh):
   if sh > 0:
@@ -127,12 +128,8 @@ def __xor_num(env, _, args):
 
 def __not_num(env, _, args):
   assert len(args) == 1
-
-  if args[1].obj_type is PowerScript_num:
-    a = to_int(args[0])
-    return num_from_py_num(~a)
-  else:
-    return PowerScript_notimpl
+  a = to_int(args[0])
+  return num_from_py_num(~a)
 
 def __eq_num(env, _, args):
   assert len(args) == 2
@@ -188,16 +185,24 @@ def __string_num(env, _, args):
     val = int(val)
   return string_from_py_string(str(val))
 
+def __hash_val(env, _, args):
+  return num_from_py_num(hash(args[0].val))
+
 def make_num(*args):
-  args = list(args)
-  obj = __new_num(None, None, args)
-  __init_num(None, None, [obj] + args)
-  return obj
+  if not args:
+    return num_from_py_num(0)
+  elif len(args) == 1:
+    arg = args[0]
+    if arg.obj_type is PowerScript_num:
+      return arg
+    return num_from_py_num(num_cast(arg, None, [arg]).val)
+  else:
+    raise PowerScriptError("Too many arguments passed to num()")
 
 def num_from_py_num(num):
-  obj = __new_num(None, None, None)
-  obj.val = num
-  return obj
+  if type(num) is int and SMALL_NUM_MIN <= num <= SMALL_NUM_MAX:
+    return small_nums[num - SMALL_NUM_MIN]
+  return NumValue(num)
 
 num_attrs = {
   "__new": BuiltinFunc(__new_num),
@@ -227,13 +232,30 @@ num_attrs = {
   "__num": BuiltinFunc(__num_num),
   "__bool": BuiltinFunc(__bool_num),
   "__string": BuiltinFunc(__string_num),
+  "__hash": BuiltinFunc(__hash_val),
 }
 
 PowerScript_num = Object(PowerScript_type, **num_attrs)
+PowerScript_num.name = "num"
+
+class NumValue(Value):
+  __slots__ = ("val",)
+  obj_type = PowerScript_num
+
+  def __init__(self, val):
+    self.val = val
+
+# nums are never changed once made, so the small integers are made once
+# and shared
+SMALL_NUM_MIN = -5
+SMALL_NUM_MAX = 1024
+
+small_nums = [NumValue(num)
+              for num in range(SMALL_NUM_MIN, SMALL_NUM_MAX + 1)]
 
 
 def __new_bool(env, _, args):
-  return make_empty_obj(PowerScript_bool)
+  return BoolValue(False)
 
 def __init_bool(env, _, args):
   obj, *args = args
@@ -253,15 +275,18 @@ def __string_bool(env, _, args):
   return string_from_py_string(string)
 
 def make_bool(*args):
-  args = list(args)
-  obj = __new_bool(None, None, args)
-  __init_bool(None, None, [obj] + args)
-  return obj
+  if not args:
+    return PowerScript_false
+  elif len(args) == 1:
+    arg = args[0]
+    if arg.obj_type is PowerScript_bool:
+      return arg
+    return bool_from_py_bool(bool_cast(arg, None, [arg]).val)
+  else:
+    raise PowerScriptError("Too many arguments passed to bool")
 
 def bool_from_py_bool(bool_):
-  obj = __new_bool(None, None, None)
-  obj.val = bool(bool_)
-  return obj
+  return PowerScript_true if bool_ else PowerScript_false
 
 
 bool_attrs = {
@@ -269,12 +294,25 @@ bool_attrs = {
   "__init": BuiltinFunc(__init_bool),
   "__bool": BuiltinFunc(__bool_bool),
   "__string": BuiltinFunc(__string_bool),
+  "__hash": BuiltinFunc(__hash_val),
 }
 
 PowerScript_bool = Object(PowerScript_type, **bool_attrs)
+PowerScript_bool.name = "bool"
+
+class BoolValue(Value):
+  __slots__ = ("val",)
+  obj_type = PowerScript_bool
+
+  def __init__(self, val):
+    self.val = val
+
+# the only two bools bool_from_py_bool and make_bool give out
+PowerScript_true = BoolValue(True)
+PowerScript_false = BoolValue(False)
 
 def __new_string(env, _, args):
-  return make_empty_obj(PowerScript_string)
+  return StringValue("")
 
 def __init_string(env, _, args):
   obj, *args = args
@@ -285,10 +323,25 @@ def __init_string(env, _, args):
 def __add_string(env, _, args):
   assert len(args) == 2
   if args[1].obj_type is PowerScript_string:
-    return string_from_py_string(args[0].val + args[1].val)
+    return add_strings(args[0], args[1])
   else:
     return PowerScript_notimpl
 
+def add_strings(left, right):
+  """Returns left + right, as a rope once left is ROPE_MIN long."""
+  if type(left) is RopeValue and left.flat is None:
+    parts = left.parts
+    if len(parts) != left.count:
+      # a longer rope was already made from left, so it gets its own parts
+      parts = parts[:left.count]
+    right = right.val
+    parts.append(right)
+    return RopeValue(parts, left.count + 1, left.size + len(right))
+  left, right = left.val, right.val
+  if len(left) < ROPE_MIN:
+    return StringValue(left + right)
+  return RopeValue([left, right], 2, len(left) + len(right))
+
 def __mul_string(env, _, args):
   assert len(args) == 2
   if args[1].obj_type is PowerScript_num:
@@ -300,8 +353,13 @@ def __mul_string(env, _, args):
 def __call_string(env, _, args):
   assert len(args) == 2
   if args[1].obj_type is PowerScript_num:
+    base, start, end = string_span(args[0])
     ind = to_int(args[1])
-    return string_from_py_string(args[0].val[ind])
+    if ind < 0:
+      ind += end - start
+    if not 0 <= ind < end - start:
+      raise PowerScriptError("String index {} out of range", ind)
+    return char_value(base[start + ind])
   else:
     return PowerScript_notimpl
 
@@ -322,7 +380,7 @@ def __neq_string(env, _, args):
 def __in_string(env, _, args):
   assert len(args) == 2
   if args[1].obj_type is PowerScript_string:
-    return bool_from_py_bool(args[0].val in args[1].val)
+    return bool_from_py_bool(args[1].val in args[0].val)
   else:
     return PowerScript_notimpl
 
@@ -334,7 +392,7 @@ def __num_string(env, _, args):
     try:
       val = float(val)
     except ValueError:
-      raise PowerScriptError("Can't cast {val} to number")
+      raise PowerScriptError("Can't cast {} to number", val)
   return num_from_py_num(val)
 
 def __bool_string(env, _, args):
@@ -343,13 +401,43 @@ def __bool_string(env, _, args):
 def __string_string(env, _, args):
   return string_from_py_string(args[0].val)
 
-def len_string(env, _, args):
-  return num_from_py_num(len(args[1].val))
+def __iter_string(env, _, args):
+  base, start, end = string_span(args[0])
+  return IterValue(map(char_value, base[start:end]))
 
-def string_from_py_string(string):  
-  obj = __new_string(None, None, None)
-  obj.val = string
-  return obj
+def len_string(env, _, args):
+  string = args[1]
+  # a rope knows its length without being joined
+  if type(string) is RopeValue and string.flat is None:
+    return num_from_py_num(string.size)
+  _, start, end = string_span(string)
+  return num_from_py_num(end - start)
+
+def slice_string(env, _, args):
+  if not 3 <= len(args) <= 4:
+    raise PowerScriptError("slice takes a start and an optional end")
+  base, start, end = string_span(args[1])
+  ind = to_int(args[2])
+  end_ind = to_int(args[3]) if len(args) == 4 else None
+  ind, end_ind, _ = slice(ind, end_ind).indices(end - start)
+  if end_ind - ind < SLICE_VIEW_MIN:
+    return string_from_py_string(base[start + ind:start + end_ind])
+  return SliceValue(base, start + ind, start + end_ind)
+
+def find_string(env, _, args):
+  if not 3 <= len(args) <= 4:
+    raise PowerScriptError("find takes a string and an optional start")
+  if args[2].obj_type is not PowerScript_string:
+    raise PowerScriptError("find takes a string")
+  base, start, end = string_span(args[1])
+  ind = to_int(args[3]) if len(args) == 4 else 0
+  if ind < 0:
+    ind = max(ind + end - start, 0)
+  found = base.find(args[2].val, start + ind, end)
+  return num_from_py_num(found - start if found >= 0 else -1)
+
+def string_from_py_string(string):
+  return StringValue(string)
 
 def make_string(*args):
   args = list(args)
@@ -372,15 +460,321 @@ string_attrs = {
   "__num": BuiltinFunc(__num_string),
   "__bool": BuiltinFunc(__bool_string),
   "__string": BuiltinFunc(__string_string),
+  "__hash": BuiltinFunc(__hash_val),
+  "__iter": BuiltinFunc(__iter_string),
 
   "len": BuiltinFunc(len_string),
+  "slice": BuiltinFunc(slice_string),
+  "find": BuiltinFunc(find_string),
 }
 
 PowerScript_string = Object(PowerScript_type, **string_attrs)
+PowerScript_string.name = "string"
+
+class StringValue(Value):
+  __slots__ = ("val",)
+  obj_type = PowerScript_string
+
+  def __init__(self, val):
+    self.val = val
+
+# adding to a string at least this long makes a rope
+ROPE_MIN = 64
+
+class RopeValue(StringValue):
+  """A string built by adding strings to a long one, joined when read.
+
+  Adding to a rope appends to its parts instead of copying it, so a
+  string built with += takes linear time. Ropes made from each other
+  share parts, which only ever grow, and a rope is its first count of
+  them. val joins them the first time it is read.
+  """
+  __slots__ = ("parts", "count", "size", "flat")
+
+  def __init__(self, parts, count, size):
+    self.parts = parts
+    self.count = count
+    self.size = size
+    self.flat = None
+
+  @property
+  def val(self):
+    if self.flat is None:
+      self.flat = "".join(self.parts[:self.count])
+    return self.flat
+
+
+# slicing out at least this many characters gives a view
+SLICE_VIEW_MIN = 64
+
+class SliceValue(StringValue):
+  """Characters start to end of the Python string base, not yet copied.
+
+  Indexing, slicing and searching a view work on base, so tokenizing a
+  long string never copies it. val copies the characters out the first
+  time anything else reads them.
+  """
+  __slots__ = ("base", "start", "end", "flat")
+
+  def __init__(self, base, start, end):
+    self.base = base
+    self.start = start
+    self.end = end
+    self.flat = None
+
+  @property
+  def val(self):
+    if self.flat is None:
+      self.flat = self.base[self.start:self.end]
+    return self.flat
+
+def string_span(string):
+  """Returns (base, start, end) such that string is base[start:end]."""
+  if type(string) is SliceValue:
+    return string.base, string.start, string.end
+  val = string.val
+  return val, 0, len(val)
+
+# strings are never changed once made, so each of the first 256
+# characters is only made once
+chars = [StringValue(chr(code)) for code in range(256)]
+
+def char_value(char):
+  code = ord(char)
+  return chars[code] if code < 256 else StringValue(char)
+
+
+def __new_builder(env, _, args):
+  return BuilderValue([])
+
+def __init_builder(env, _, args):
+  obj, *args = args
+  obj.parts = [string_cast(arg, env, [arg]).val for arg in args]
+
+def append_builder(env, _, args):
+  parts = args[1].parts
+  for arg in args[2:]:
+    if arg.obj_type is not PowerScript_string:
+      arg = string_cast(arg, env, [arg])
+    parts.append(arg.val)
+  return PowerScript_none
+
+def build_builder(env, _, args):
+  parts = args[1].parts
+  string = "".join(parts)
+  # later builds only join what was appended since
+  parts[:] = [string]
+  return string_from_py_string(string)
+
+def __string_builder(env, _, args):
+  return build_builder(env, _, [None, args[0]])
+
+def len_builder(env, _, args):
+  return num_from_py_num(sum(map(len, args[1].parts)))
+
+def make_builder(*args):
+  args = list(args)
+  obj = __new_builder(None, None, args)
+  __init_builder(None, None, [obj] + args)
+  return obj
+
+builder_attrs = {
+  "__new": BuiltinFunc(__new_builder),
+  "__init": BuiltinFunc(__init_builder),
+
+  "__string": BuiltinFunc(__string_builder),
+
+  "append": BuiltinFunc(append_builder),
+  "build": BuiltinFunc(build_builder),
+  "len": BuiltinFunc(len_builder),
+}
+
+PowerScript_builder = Object(PowerScript_type, **builder_attrs)
+PowerScript_builder.name = "builder"
+
+class BuilderValue(Value):
+  """A string being built from parts, joined by build."""
+  __slots__ = ("parts",)
+  obj_type = PowerScript_builder
+
+  def __init__(self, parts):
+    self.parts = parts
+
+
+def view(obj):
+  """Returns a memoryview of the bytes in obj, without copying them."""
+  return memoryview(obj.data)[obj.start:obj.end]
+
+def bytes_arg(arg, name):
+  """Returns the Python bytes-like value of a bytes or string argument."""
+  if arg.obj_type is PowerScript_bytes:
+    return view(arg)
+  elif arg.obj_type is PowerScript_string:
+    return arg.val.encode()
+  raise PowerScriptError(f"{name} takes bytes or a string")
+
+def __new_bytes(env, _, args):
+  return BytesValue(b"", 0, 0)
+
+def __init_bytes(env, _, args):
+  obj, *args = args
+  if not args:
+    data = b""
+  elif len(args) > 1:
+    raise PowerScriptError("Too many arguments passed to bytes")
+  elif args[0].obj_type is PowerScript_bytes:
+    # bytes are never changed, so they can share their data
+    obj.data, obj.start, obj.end = args[0].data, args[0].start, args[0].end
+    return
+  elif args[0].obj_type is PowerScript_string:
+    data = args[0].val.encode()
+  elif args[0].obj_type is PowerScript_list:
+    try:
+      data = bytes(to_int(val) for val in args[0].vals)
+    except ValueError:
+      raise PowerScriptError("bytes must be in range(0, 256)") from None
+  else:
+    raise CastError("Can't convert {} to bytes", type_name(args[0]))
+  obj.data, obj.start, obj.end = data, 0, len(data)
+
+def __add_bytes(env, _, args):
+  assert len(args) == 2
+  if args[1].obj_type is PowerScript_bytes:
+    data = bytes(view(args[0])) + view(args[1])
+    return BytesValue(data, 0, len(data))
+  else:
+    return PowerScript_notimpl
+
+def __call_bytes(env, _, args):
+  assert len(args) == 2
+  if args[1].obj_type is PowerScript_num:
+    obj = args[0]
+    ind = to_int(args[1])
+    if ind < 0:
+      ind += obj.end - obj.start
+    if not 0 <= ind < obj.end - obj.start:
+      raise PowerScriptError("Bytes index {} out of range", ind)
+    return num_from_py_num(obj.data[obj.start + ind])
+  else:
+    return PowerScript_notimpl
+
+def __eq_bytes(env, _, args):
+  assert len(args) == 2
+  if args[1].obj_type is PowerScript_bytes:
+    return bool_from_py_bool(view(args[0]) == view(args[1]))
+  else:
+    return PowerScript_notimpl
+
+def __neq_bytes(env, _, args):
+  assert len(args) == 2
+  if args[1].obj_type is PowerScript_bytes:
+    return bool_from_py_bool(view(args[0]) != view(args[1]))
+  else:
+    return PowerScript_notimpl
+
+def __in_bytes(env, _, args):
+  assert len(args) == 2
+  obj = args[0]
+  if args[1].obj_type is PowerScript_num:
+    byte = to_int(args[1])
+    if not 0 <= byte < 256:
+      return bool_from_py_bool(False)
+    # mapped files only find bytes-like values
+    found = obj.data.find(bytes([byte]), obj.start, obj.end)
+  else:
+    found = obj.data.find(bytes_arg(args[1], "<|"), obj.start, obj.end)
+  return bool_from_py_bool(found >= 0)
+
+def __iter_bytes(env, _, args):
+  return IterValue(map(num_from_py_num, view(args[0])))
+
+def __hash_bytes(env, _, args):
+  return num_from_py_num(hash(bytes(view(args[0]))))
+
+def __string_bytes(env, _, args):
+  return string_from_py_string(str(view(args[0]), "utf-8", "replace"))
+
+def len_bytes(env, _, args):
+  return num_from_py_num(args[1].end - args[1].start)
+
+def slice_bytes(env, _, args):
+  if not 3 <= len(args) <= 4:
+    raise PowerScriptError("slice takes a start and an optional end")
+  obj = args[1]
+  ind = to_int(args[2])
+  end_ind = to_int(args[3]) if len(args) == 4 else None
+  ind, end_ind, _ = slice(ind, end_ind).indices(obj.end - obj.start)
+  return BytesValue(obj.data, obj.start + ind,
+                    obj.start + max(ind, end_ind))
+
+def find_bytes(env, _, args):
+  if not 3 <= len(args) <= 4:
+    raise PowerScriptError("find takes bytes and an optional start")
+  obj = args[1]
+  ind = to_int(args[3]) if len(args) == 4 else 0
+  if ind < 0:
+    ind = max(ind + obj.end - obj.start, 0)
+  found = obj.data.find(bytes_arg(args[2], "find"), obj.start + ind, obj.end)
+  return num_from_py_num(found - obj.start if found >= 0 else -1)
+
+def decode_bytes(env, _, args):
+  try:
+    return string_from_py_string(str(view(args[1]), "utf-8"))
+  except UnicodeDecodeError as err:
+    raise PowerScriptError("Can't decode bytes: {}", err.reason) from None
+
+def tolist_bytes(env, _, args):
+  return list_from_py_list([num_from_py_num(byte)
+                            for byte in view(args[1])])
+
+def make_bytes(*args):
+  args = list(args)
+  obj = __new_bytes(None, None, args)
+  __init_bytes(None, None, [obj] + args)
+  return obj
+
+bytes_attrs = {
+  "__new": BuiltinFunc(__new_bytes),
+  "__init": BuiltinFunc(__init_bytes),
+  "__add": BuiltinFunc(__add_bytes),
+  "__call": BuiltinFunc(__call_bytes),
+
+  "__eq": BuiltinFunc(__eq_bytes),
+  "__neq": BuiltinFunc(__neq_bytes),
+
+  "__in": BuiltinFunc(__in_bytes),
+  "__iter": BuiltinFunc(__iter_bytes),
+
+  "__string": BuiltinFunc(__string_bytes),
+  "__hash": BuiltinFunc(__hash_bytes),
+
+  "len": BuiltinFunc(len_bytes),
+  "slice": BuiltinFunc(slice_bytes),
+  "find": BuiltinFunc(find_bytes),
+  "decode": BuiltinFunc(decode_bytes),
+  "tolist": BuiltinFunc(tolist_bytes),
+}
+
+PowerScript_bytes = Object(PowerScript_type, **bytes_attrs)
+PowerScript_bytes.name = "bytes"
+
+class BytesValue(Value):
+  """Bytes start to end of data, which slices of them share.
+
+  data is anything with the buffer protocol and a find method, such as
+  bytes or a mapped file, and is never changed.
+  """
+  __slots__ = ("data", "start", "end")
+  obj_type = PowerScript_bytes
+
+  def __init__(self, data, start, end):
+    self.data = data
+    self.start = start
+    self.end = end
 
 
 def __new_list(env, _, args):
-  return make_empty_obj(PowerScript_list)
+  return ListValue([])
 
 def __init_list(env, _, args):
   obj, *args = args
@@ -438,6 +832,9 @@ def __in_list(env, _, args):
       return bool_from_py_bool(True)
   return bool_from_py_bool(False)
 
+def __iter_list(env, _, args):
+  return IterValue(iter(args[0].vals))
+
 def len_list(env, _, args):
   return num_from_py_num(len(args[1].vals))
 
@@ -451,10 +848,101 @@ def pop_list(env, _, args):
   else:
     raise PowerScriptError("Pop from empty list")
 
+def slice_list(env, _, args):
+  if not 3 <= len(args) <= 4:
+    raise PowerScriptError("slice takes a start and an optional end")
+  vals = args[1].vals
+  start = to_int(args[2])
+  end = to_int(args[3]) if len(args) == 4 else len(vals)
+  return list_from_py_list(vals[start:end])
+
+def extend_list(env, _, args):
+  if len(args) != 3 or args[2].obj_type is not PowerScript_list:
+    raise PowerScriptError("extend takes a list")
+  args[1].vals.extend(args[2].vals)
+  return PowerScript_none
+
+def insert_list(env, _, args):
+  if len(args) != 4:
+    raise PowerScriptError("insert takes an index and a value")
+  args[1].vals.insert(to_int(args[2]), args[3])
+  return PowerScript_none
+
+def index_list(env, _, args):
+  if len(args) != 3:
+    raise PowerScriptError("index takes a value")
+  val = args[2]
+  for ind, elem in enumerate(args[1].vals):
+    if elem is val or make_bool(eq(elem, env, [elem, val])).val:
+      return num_from_py_num(ind)
+  raise PowerScriptError("Value not in list")
+
+def reverse_list(env, _, args):
+  args[1].vals.reverse()
+  return PowerScript_none
+
+class LtKey():
+  """Sorts a value like PowerScript's < does."""
+  __slots__ = ("env", "val")
+
+  def __init__(self, env, val):
+    self.env = env
+    self.val = val
+
+  def __lt__(self, other):
+    return make_bool(lt(self.val, self.env, [self.val, other.val])).val
+
+def py_keys(env, vals):
+  """Returns Python values for vals that compare like they do.
+
+  When they are all nums or all strings their own vals are used, so
+  comparing them never goes through lt.
+  """
+  obj_type = vals[0].obj_type if vals else None
+  if obj_type is PowerScript_num or obj_type is PowerScript_string:
+    if all(val.obj_type is obj_type for val in vals):
+      return [val.val for val in vals]
+  return [LtKey(env, val) for val in vals]
+
+def sort_list(env, _, args):
+  vals = args[1].vals
+  if len(args) == 2:
+    keys = vals
+  elif len(args) == 3:
+    key = args[2]
+    keys = [call(key, env, [key, val]) for val in vals]
+  else:
+    raise PowerScriptError("sort takes an optional key function")
+  keys = py_keys(env, keys)
+  order = sorted(range(len(vals)), key=keys.__getitem__)
+  vals[:] = [vals[ind] for ind in order]
+  return PowerScript_none
+
+def min_list(env, _, args):
+  vals = args[1].vals
+  if not vals:
+    raise PowerScriptError("min of empty list")
+  keys = py_keys(env, vals)
+  return vals[min(range(len(vals)), key=keys.__getitem__)]
+
+def max_list(env, _, args):
+  vals = args[1].vals
+  if not vals:
+    raise PowerScriptError("max of empty list")
+  keys = py_keys(env, vals)
+  return vals[max(range(len(vals)), key=keys.__getitem__)]
+
+def sum_list(env, _, args):
+  vals = args[1].vals
+  if all(val.obj_type is PowerScript_num for val in vals):
+    return num_from_py_num(sum(val.val for val in vals))
+  total, *vals = vals
+  for val in vals:
+    total = add(total, env, [total, val])
+  return total
+
 def list_from_py_list(vals):
-  obj = __new_list(None, None, None)
-  obj.vals = vals
-  return obj
+  return ListValue(vals)
 
 def make_list(*args):
   obj = __new_list(None, None, args)
@@ -471,49 +959,449 @@ list_attrs = {
   "__neq": BuiltinFunc(__neq_list),
 
   "__in": BuiltinFunc(__in_list),
+  "__iter": BuiltinFunc(__iter_list),
 
   "len": BuiltinFunc(len_list),
   "append": BuiltinFunc(append_list),
   "pop": BuiltinFunc(pop_list),
+  "slice": BuiltinFunc(slice_list),
+  "extend": BuiltinFunc(extend_list),
+  "insert": BuiltinFunc(insert_list),
+  "index": BuiltinFunc(index_list),
+  "reverse": BuiltinFunc(reverse_list),
+  "sort": BuiltinFunc(sort_list),
+  "min": BuiltinFunc(min_list),
+  "max": BuiltinFunc(max_list),
+  "sum": BuiltinFunc(sum_list),
 }
 
 PowerScript_list = Object(PowerScript_type, **list_attrs)
-
+PowerScript_list.name = "list"
+
+class ListValue(Value):
+  __slots__ = ("vals",)
+  obj_type = PowerScript_list
+
+  def __init__(self, vals):
+    self.vals = vals
+
+
+# dicts and sets keep their values under Python keys. Nums, strings and
+# bools hash natively, so their keys are (type, val) and never call back
+# into PowerScript; any other value is wrapped in a HashKey, which uses its
+# __hash and __eq.
+
+class HashKey():
+  """The key of a value hashed with its __hash method."""
+  __slots__ = ("env", "val", "hash")
+
+  def __init__(self, env, val):
+    self.env = env
+    self.val = val
+    res = hash_(val, env, [val])
+    if res.obj_type is not PowerScript_num:
+      raise HashError("__hash must give a num, not {}", type_name(res))
+    self.hash = hash(res.val)
+
+  def __hash__(self):
+    return self.hash
+
+  def __eq__(self, other):
+    if not isinstance(other, HashKey):
+      return NotImplemented
+    if self.val is other.val:
+      return True
+    return make_bool(eq(self.val, self.env, [self.val, other.val])).val
+
+def hash_key(env, val):
+  """Returns the Python key val is kept under in dicts and sets."""
+  obj_type = val.obj_type
+  if (obj_type is PowerScript_num or obj_type is PowerScript_string or
+      obj_type is PowerScript_bool):
+    return (obj_type, val.val)
+  return HashKey(env, val)
+
+def pair_arg(pair):
+  if pair.obj_type is not PowerScript_list or len(pair.vals) != 2:
+    raise PowerScriptError("dict needs [key, value] pairs")
+  return pair.vals
 
 def __new_dict(env, _, args):
-  return make_empty_obj(PowerScript_func)
+  return DictValue({})
 
-dict_attrs = {
+def __init_dict(env, _, args):
+  obj, *args = args
+  if not args:
+    obj.vals = {}
+  elif len(args) > 1:
+    raise PowerScriptError("Too many arguments passed to dict")
+  elif args[0].obj_type is PowerScript_dict:
+    obj.vals = dict(args[0].vals)
+  elif args[0].obj_type is PowerScript_list:
+    obj.vals = {}
+    for pair in args[0].vals:
+      key, val = pair_arg(pair)
+      obj.vals[hash_key(env, key)] = (key, val)
+  else:
+    raise CastError("Can't convert {} to dict", type_name(args[0]))
+
+def __call_dict(env, _, args):
+  assert len(args) == 2
+  item = args[0].vals.get(hash_key(env, args[1]))
+  if item is None:
+    raise PowerScriptError("Key not in dict")
+  return item[1]
+
+def __in_dict(env, _, args):
+  assert len(args) == 2
+  return bool_from_py_bool(hash_key(env, args[1]) in args[0].vals)
 
+def __iter_dict(env, _, args):
+  # the keys are copied, so the loop can change the dict
+  return IterValue(iter([key for key, _ in args[0].vals.values()]))
+
+def __string_dict(env, _, args):
+  items = [make_string(key).val + ": " + make_string(val).val
+           for key, val in args[0].vals.values()]
+  return string_from_py_string("{" + ", ".join(items) + "}")
+
+def len_dict(env, _, args):
+  return num_from_py_num(len(args[1].vals))
+
+def get_dict(env, _, args):
+  if not 3 <= len(args) <= 4:
+    raise PowerScriptError("get takes a key and an optional default")
+  item = args[1].vals.get(hash_key(env, args[2]))
+  if item is None:
+    return args[3] if len(args) == 4 else PowerScript_none
+  return item[1]
+
+def set_dict(env, _, args):
+  if len(args) != 4:
+    raise PowerScriptError("set takes a key and a value")
+  key = args[2]
+  args[1].vals[hash_key(env, key)] = (key, args[3])
+  return PowerScript_none
+
+def remove_dict(env, _, args):
+  if len(args) != 3:
+    raise PowerScriptError("remove takes a key")
+  item = args[1].vals.pop(hash_key(env, args[2]), None)
+  if item is None:
+    raise PowerScriptError("Key not in dict")
+  return item[1]
+
+def keys_dict(env, _, args):
+  return list_from_py_list([key for key, _ in args[1].vals.values()])
+
+def values_dict(env, _, args):
+  return list_from_py_list([val for _, val in args[1].vals.values()])
+
+def items_dict(env, _, args):
+  return list_from_py_list([list_from_py_list(list(item))
+                            for item in args[1].vals.values()])
+
+def dict_from_py_pairs(env, pairs):
+  return DictValue({hash_key(env, key): (key, val) for key, val in pairs})
+
+def make_dict(*args):
+  args = list(args)
+  obj = __new_dict(None, None, args)
+  __init_dict(None, None, [obj] + args)
+  return obj
+
+dict_attrs = {
+  "__new": BuiltinFunc(__new_dict),
+  "__init": BuiltinFunc(__init_dict),
+  "__call": BuiltinFunc(__call_dict),
+
+  "__in": BuiltinFunc(__in_dict),
+  "__iter": BuiltinFunc(__iter_dict),
+
+  "__string": BuiltinFunc(__string_dict),
+
+  "len": BuiltinFunc(len_dict),
+  "get": BuiltinFunc(get_dict),
+  "set": BuiltinFunc(set_dict),
+  "remove": BuiltinFunc(remove_dict),
+  "keys": BuiltinFunc(keys_dict),
+  "values": BuiltinFunc(values_dict),
+  "items": BuiltinFunc(items_dict),
 }
 
 PowerScript_dict = Object(PowerScript_type, **dict_attrs)
+PowerScript_dict.name = "dict"
+
+class DictValue(Value):
+  """A dict, whose vals map the hash_key of each key to (key, value)."""
+  __slots__ = ("vals",)
+  obj_type = PowerScript_dict
+
+  def __init__(self, vals):
+    self.vals = vals
+
+
+def __new_set(env, _, args):
+  return SetValue({})
+
+def __init_set(env, _, args):
+  obj, *args = args
+  if not args:
+    obj.vals = {}
+  elif len(args) > 1:
+    raise PowerScriptError("Too many arguments passed to set")
+  elif args[0].obj_type is PowerScript_set:
+    obj.vals = dict(args[0].vals)
+  elif args[0].obj_type is PowerScript_list:
+    obj.vals = {hash_key(env, val): val for val in args[0].vals}
+  else:
+    raise CastError("Can't convert {} to set", type_name(args[0]))
+
+def __in_set(env, _, args):
+  assert len(args) == 2
+  return bool_from_py_bool(hash_key(env, args[1]) in args[0].vals)
+
+def __iter_set(env, _, args):
+  return IterValue(iter(list(args[0].vals.values())))
+
+def __string_set(env, _, args):
+  vals = [make_string(val).val for val in args[0].vals.values()]
+  return string_from_py_string("{" + ", ".join(vals) + "}")
+
+def len_set(env, _, args):
+  return num_from_py_num(len(args[1].vals))
+
+def add_set(env, _, args):
+  if len(args) != 3:
+    raise PowerScriptError("add takes a value")
+  args[1].vals.setdefault(hash_key(env, args[2]), args[2])
+  return PowerScript_none
+
+def remove_set(env, _, args):
+  if len(args) != 3:
+    raise PowerScriptError("remove takes a value")
+  if args[1].vals.pop(hash_key(env, args[2]), None) is None:
+    raise PowerScriptError("Value not in set")
+  return PowerScript_none
+
+def tolist_set(env, _, args):
+  return list_from_py_list(list(args[1].vals.values()))
+
+def set_from_py_list(env, vals):
+  return SetValue({hash_key(env, val): val for val in vals})
+
+def make_set(*args):
+  args = list(args)
+  obj = __new_set(None, None, args)
+  __init_set(None, None, [obj] + args)
+  return obj
+
+set_attrs = {
+  "__new": BuiltinFunc(__new_set),
+  "__init": BuiltinFunc(__init_set),
+
+  "__in": BuiltinFunc(__in_set),
+  "__iter": BuiltinFunc(__iter_set),
+
+  "__string": BuiltinFunc(__string_set),
+
+  "len": BuiltinFunc(len_set),
+  "add": BuiltinFunc(add_set),
+  "remove": BuiltinFunc(remove_set),
+  "tolist": BuiltinFunc(tolist_set),
+}
+
+PowerScript_set = Object(PowerScript_type, **set_attrs)
+PowerScript_set.name = "set"
+
+class SetValue(Value):
+  """A set, whose vals map the hash_key of each value to the value."""
+  __slots__ = ("vals",)
+  obj_type = PowerScript_set
+
+  def __init__(self, vals):
+    self.vals = vals
 
 
 def __new_func(env, _, args):
-  return make_empty_obj(PowerScript_func)
+  return FuncValue()
 
 def __init_func(env, _, args):
   raise PowerScriptError("Cannot init Func")
 
+def make_frame(obj, args):
+  """Returns the frame a call of the function obj with args runs in."""
+  captures, derefs, arg_slots, cells, nested = obj.layout
+  scope = obj.scopes
+  if nested:
+    frame = list(scope)
+    for slot in derefs:
+      frame[slot] = frame[slot].val
+  else:
+    frame = [scope[ind] for ind in captures]
+  for slot, arg in zip(arg_slots, args):
+    frame[slot] = arg
+  for slot in cells:
+    frame[slot] = Cell(frame[slot])
+  return frame
+
 def __call_func(env, _, args):
   obj, *args = args
-  env.add_frame(scope.copy() for scope in obj.scopes)
-  env.add_scopes([dict(zip(obj.arg_names, args))])
-  PowerScriptexec.exec_line(env, obj.line)
-  return env.remove_frame()
-
-def make_func(arg_names, scopes, line):
-  obj = __new_func(None, None, None)
-  obj.arg_names = arg_names
-  obj.scopes = scopes
-  obj.line = line
-  return obj
+  env.add_frame(make_frame(obj, args))
+  try:
+    obj.exec_body(env, obj.line)
+  finally:
+    res = env.remove_frame()
+  return res
+
+def make_func(arg_names, layout, scopes, line, exec_body=None):
+  """Makes a function whose body is run with exec_body(env, line).
+
+  layout is what the resolver gave the function's FuncLine, and scopes
+  is the frame it is defined in. A function defined in another one keeps
+  only the slots it uses, and copies the global frame's when it is
+  called.
+
+  line is whatever the engine that defined the function runs: an AST
+  line for the tree walker, a Code object for the VM or a closure for
+  the closure compiler.
+  """
+  captures, _, _, _, nested = layout
+  if nested:
+    scopes = [scopes[ind] for ind in captures]
+  return FuncValue(arg_names, layout, scopes, line,
+                   exec_body or PowerScriptexec.exec_line)
 
 
 func_attrs = {
   "__call": BuiltinFunc(__call_func),
-  # TODO: finish dicts, add ast nodes
 }
 
-PowerScript_func = Object(PowerScript_type, **func_attrs)
\ No newline at end of file
+PowerScript_func = Object(PowerScript_type, **func_attrs)
+PowerScript_func.name = "func"
+
+class FuncValue(Value):
+  __slots__ = ("arg_names", "layout", "scopes", "line", "exec_body")
+  obj_type = PowerScript_func
+
+  def __init__(self, arg_names=None, layout=None, scopes=None, line=None,
+               exec_body=None):
+    self.arg_names = arg_names
+    self.layout = layout
+    self.scopes = scopes
+    self.line = line
+    self.exec_body = exec_body
+
+
+# for loops go through the values __iter gives. Builtin types give an
+# IterValue, whose Python iterator the loop runs directly, so nothing but
+# the values themselves is made per step. Any other iterator is stepped
+# with its __next, which gives notimpl once it is done.
+
+def __iter_iterator(env, _, args):
+  return args[0]
+
+def __next_iterator(env, _, args):
+  return next(args[0].it, PowerScript_notimpl)
+
+def py_iter(env, val):
+  """Returns a Python iterator over the values of val."""
+  it = iter_(val, env, [val])
+  if type(it) is IterValue:
+    return it.it
+  return call_next(env, it)
+
+def call_next(env, it):
+  if "__next" in it.attrs:
+    func = it.attrs["__next"]
+  elif "__next" in it.obj_type.attrs:
+    func = it.obj_type.attrs["__next"]
+  else:
+    raise IterError("{} is not an iterator", type_name(it))
+  while True:
+    val = call(func, env, [func, it])
+    if val is PowerScript_notimpl:
+      return
+    yield val
+
+iterator_attrs = {
+  "__iter": BuiltinFunc(__iter_iterator),
+  "__next": BuiltinFunc(__next_iterator),
+}
+
+PowerScript_iterator = Object(PowerScript_type, **iterator_attrs)
+PowerScript_iterator.name = "iterator"
+
+class IterValue(Value):
+  """An iterator running the Python iterator it, which gives values."""
+  __slots__ = ("it",)
+  obj_type = PowerScript_iterator
+
+  def __init__(self, it):
+    self.it = it
+
+
+def __new_range(env, _, args):
+  return RangeValue(range(0))
+
+def __init_range(env, _, args):
+  obj, *args = args
+  if not 1 <= len(args) <= 3:
+    raise PowerScriptError("range takes an end, or a start, end and step")
+  bounds = [to_int(arg) for arg in args]
+  if len(bounds) == 3 and not bounds[2]:
+    raise PowerScriptError("range step can't be 0")
+  obj.range = range(*bounds)
+
+def __iter_range(env, _, args):
+  return IterValue(map(num_from_py_num, args[0].range))
+
+def __in_range(env, _, args):
+  assert len(args) == 2
+  if args[1].obj_type is PowerScript_num:
+    return bool_from_py_bool(args[1].val in args[0].range)
+  return bool_from_py_bool(False)
+
+def __call_range(env, _, args):
+  assert len(args) == 2
+  if args[1].obj_type is PowerScript_num:
+    try:
+      return num_from_py_num(args[0].range[to_int(args[1])])
+    except IndexError:
+      raise PowerScriptError("Range index out of range") from None
+  else:
+    return PowerScript_notimpl
+
+def len_range(env, _, args):
+  return num_from_py_num(len(args[1].range))
+
+def tolist_range(env, _, args):
+  return list_from_py_list(list(map(num_from_py_num, args[1].range)))
+
+def make_range(*args):
+  args = list(args)
+  obj = __new_range(None, None, args)
+  __init_range(None, None, [obj] + args)
+  return obj
+
+range_attrs = {
+  "__new": BuiltinFunc(__new_range),
+  "__init": BuiltinFunc(__init_range),
+  "__call": BuiltinFunc(__call_range),
+
+  "__in": BuiltinFunc(__in_range),
+  "__iter": BuiltinFunc(__iter_range),
+
+  "len": BuiltinFunc(len_range),
+  "tolist": BuiltinFunc(tolist_range),
+}
+
+PowerScript_range = Object(PowerScript_type, **range_attrs)
+PowerScript_range.name = "range"
+
+class RangeValue(Value):
+  __slots__ = ("range",)
+  obj_type = PowerScript_range
+
+  def __init__(self, range_):
+    self.range = range_
@@ -1,9 +1,9 @@
 import PowerScripttokenizer as tokenizer
 import PowerScriptast as ast
+from PowerScriptresolver import Resolver
 
 # precedence:
-# call: ()
-# dot: .
+# call, colon call, dot: () : .
 # unary: - ~ not
 # bool: and or
 # e: **
@@ -31,12 +31,6 @@ CMP = {"EQ", "NEQ", "LEQ", "GEQ", "LT",
 
 OPS = BOOL | POW | MUL_DIV | ADD_SUB | SHIFT | BIN | CMP
 
-def get_line_pos(text, ind):
-  before_ind = text[:ind]
-  line = before_ind.count("\n") + 1
-  pos = len(before_ind.rsplit("\n", 1)[1])
-  return line, pos
-
 def expected_err(toks, *types):
   if len(types) == 1:
     lst = types[0]
@@ -44,123 +38,80 @@ def expected_err(toks, *types):
     lst = f"{types[0]} or {types[1]}"
   else:
     lst = ", ".join(types[:-1]) + ", or" + types[-1]
-  code = toks.code
-  line_no, pos = get_line_pos(code, toks.tok.ind)
-  line = code.split("\n")[line_no - 1]
-  marker = " " * pos + "^"
-  raise SyntaxError(f"Expected {lst}, got {toks.tok.name}"
-                    f" at line {line_no}:\n"
-                    f"{line}\n{marker}")
-
-# EXPRESSIONS
-
-def parse_cmp(toks):
-  sub_exprs = [parse_bin(toks)]
-  ops = []
-  while toks.tok.name in CMP:
-    ops.append(toks.advance().name)
-    sub_exprs.append(parse_bin(toks))
-  
-  if ops:
-    return ast.CmpExpr(ops, sub_exprs)
-  else:
-    return sub_exprs[0]
+  where = toks.source_map.describe(start_pos(toks))
+  raise SyntaxError(f"Expected {lst}, got {toks.tok.name} at {where}")
 
-parse_expr = parse_cmp
-
-def parse_bin(toks):
-  left = parse_shift(toks)
-  if toks.tok.name in BIN:
-    op = toks.advance().name
-    right = parse_bin(toks)
-    return ast.BinExpr(op, left, right)
-  else:
-    return left
-
-def parse_shift(toks):
-  left = parse_add_sub(toks)
-  if toks.tok.name in SHIFT:
-    op = toks.advance().name
-    right = parse_shift(toks)
-    return ast.BinExpr(op, left, right)
-  else:
-    return left
-
-def parse_add_sub(toks):
-  left = parse_mul_div(toks)
-  if toks.tok.name in ADD_SUB:
-    op = toks.advance().name
-    right = parse_add_sub(toks)
-    return ast.BinExpr(op, left, right)
-  else:
-    return left
+def start_pos(toks):
+  """The source index the current token starts at."""
+  tok = toks.tok
+  if tok.ind < 0:
+    return tok.ind
+  return tok.ind - len(tok.text)
 
-def parse_mul_div(toks):
-  left = parse_pow(toks)
-  if toks.tok.name in MUL_DIV:
-    op = toks.advance().name
-    right = parse_mul_div(toks)
-    return ast.BinExpr(op, left, right)
-  else:
-    return left
-
-def parse_pow(toks):
-  left = parse_bool(toks)
-  if toks.tok.name in POW:
-    op = toks.advance().name
-    right = parse_pow(toks)
-    return ast.BinExpr(op, left, right)
-  else:
-    return left
-
-def parse_bool(toks):
-  left = parse_unary(toks)
-  if toks.tok.name in BOOL:
-    op = toks.advance().name
-    right = parse_bool(toks)
-    return ast.BinExpr(op, left, right)
-  return left
-
-def parse_unary(toks):
-  if toks.tok.name in UNARY:
-    op = toks.advance().name
-    return ast.UnaryExpr(op, parse_call(toks))
-  else:
-    return parse_call(toks)
-
-def parse_call(toks):
-  func = parse_colon(toks)
-  if toks.tok.name == "OPAREN":
-    return ast.CallExpr(func, parse_arglist(toks))
-  else:
-    return func
+# EXPRESSIONS
 
-def parse_colon(toks):
-  expr = parse_dotted(toks)
-  while toks.tok.name == "COLON":
+# binding power of each binary operator; higher binds tighter
+BINARY_PRECEDENCE = {}
+for prec, ops in enumerate([CMP, BIN, SHIFT, ADD_SUB, MUL_DIV, POW, BOOL],
+                           start=1):
+  for op in ops:
+    BINARY_PRECEDENCE[op] = prec
+
+RIGHT_ASSOC = POW
+
+def parse_expr(toks, min_prec=1, colon_calls=True):
+  """Parses operators binding at least as tightly as min_prec.
+
+  Operators of the same precedence associate to the left, except for
+  those in RIGHT_ASSOC. Comparisons chain into a single CmpExpr. With
+  colon_calls=False, a colon ends the expression instead of starting a
+  colon call, as it does after a key in a dict literal.
+  """
+  left = parse_unary(toks, colon_calls)
+  while True:
+    op = toks.tok.name
+    prec = BINARY_PRECEDENCE.get(op)
+    if prec is None or prec < min_prec:
+      return left
+    
     toks.advance()
-    if toks.tok.name == "IDENT":
-      name = toks.advance().text
-      if toks.tok.name == "OPAREN":
-        args = parse_arglist(toks)
-        return ast.ColonCallExpr(expr, name, args)
-      else:
-        expected_err(toks, "OPAREN")
+    if op in CMP:
+      ops = [op]
+      sub_exprs = [left, parse_expr(toks, prec + 1, colon_calls)]
+      while toks.tok.name in CMP:
+        ops.append(toks.advance().name)
+        sub_exprs.append(parse_expr(toks, prec + 1, colon_calls))
+      left = ast.CmpExpr(ops, sub_exprs)
+    elif op in RIGHT_ASSOC:
+      left = ast.BinExpr(op, left, parse_expr(toks, prec, colon_calls))
     else:
-      expected_err(toks, "IDENT")
-  return expr
+      left = ast.BinExpr(op, left, parse_expr(toks, prec + 1, colon_calls))
 
-def parse_dotted(toks):
+def parse_unary(toks, colon_calls=True):
+  if toks.tok.name in UNARY:
+    op = toks.advance().name
+    return ast.UnaryExpr(op, parse_unary(toks, colon_calls))
+  
   expr = parse_base_expr(toks)
-  if toks.tok.name == "DOT":
-    toks.advance()
-    if toks.tok.name == "IDENT":
+  while True:
+    name = toks.tok.name
+    if name == "OPAREN":
+      expr = ast.CallExpr(expr, parse_arglist(toks))
+    elif name == "COLON" and colon_calls:
+      toks.advance()
+      if toks.tok.name != "IDENT":
+        expected_err(toks, "IDENT")
       name = toks.advance().text
-      return ast.DotExpr(expr, name)
+      if toks.tok.name != "OPAREN":
+        expected_err(toks, "OPAREN")
+      expr = ast.ColonCallExpr(expr, name, parse_arglist(toks))
+    elif name == "DOT":
+      toks.advance()
+      if toks.tok.name != "IDENT":
+        expected_err(toks, "IDENT")
+      expr = ast.DotExpr(expr, toks.advance().text)
     else:
-      expected_err(toks, "IDENT")
-
-  return expr
+      return expr
 
 def parse_arglist(toks):
   args = []
@@ -180,31 +131,24 @@ def parse_arglist(toks):
 
   return args
 
+def parse_paren(toks):
+  with toks.ignorectx("NEWLINE"):
+    toks.advance()
+    res = parse_expr(toks)
+    if toks.tok.name != "CPAREN":
+      expected_err(toks, "CPAREN")
+  # a newline after the closing paren still ends the line
+  toks.advance()
+  return res
+
+def parse_ident(toks):
+  return ast.IdentExpr(toks.advance().text)
+
 def parse_base_expr(toks):
-  if toks.tok.name == "OPAREN":
-    with toks.ignorectx("NEWLINE"):
-      toks.advance()
-      res = parse_expr(toks)
-      if toks.tok.name != "CPAREN":
-        expected_err(toks, "CPAREN")
-      toks.advance()
-      return res
-  elif toks.tok.name == "IDENT":
-    return ast.IdentExpr(toks.advance().text)
-  else:
-    return parse_literal(toks)
-
-def parse_literal(toks):
-  if toks.tok.name == "NUM":
-    return parse_num_lit(toks)
-  elif toks.tok.name == "BOOL":
-    return parse_bool_lit(toks)
-  elif toks.tok.name == "STRING":
-    return parse_string_lit(toks)
-  elif toks.tok.name == "OLIST":
-    return parse_list(toks)
-  else:
+  parse_prefix = PREFIX_PARSERS.get(toks.tok.name)
+  if parse_prefix is None:
     expected_err(toks, "NUM", "OLIST")
+  return parse_prefix(toks)
 
 def parse_num_lit(toks):
   text = toks.advance().text
@@ -246,89 +190,184 @@ def parse_list(toks):
   toks.advance()
   return ast.ListExpr(res)
 
-# END EXPRESSIONS
+def parse_dict_or_set(toks):
+  """Parses {} or {k: v, ...} as a dict and {a, b, ...} as a set.
 
-def parse_line(toks):
-  if toks.tok.name == "OBLOCK":
+  The colon after a key ends it, so a colon call in a key needs parens.
+  """
+  keys = []
+  vals = []
+  is_dict = None
+  with toks.ignorectx("NEWLINE"):
     toks.advance()
-    lines = []
     while toks.tok.name != "CBLOCK":
-      if toks.tok.name == "NEWLINE":
-        toks.advance()
-        continue
-      
-      lines.append(parse_line(toks))
-      if toks.tok.name == "NEWLINE":
-        toks.advance()
-        continue
-      elif toks.tok.name == "CBLOCK":
-        break
+      if is_dict is False:
+        vals.append(parse_expr(toks))
       else:
-        expected_err(toks, "NEWLINE", "CBLOCK")
+        key = parse_expr(toks, colon_calls=False)
+        if is_dict is None:
+          is_dict = toks.tok.name == "COLON"
+        if is_dict:
+          if toks.tok.name != "COLON":
+            expected_err(toks, "COLON")
+          toks.advance()
+          keys.append(key)
+          vals.append(parse_expr(toks))
+        else:
+          vals.append(key)
+
+      if toks.tok.name == "COMMA":
+        toks.advance()
+      elif toks.tok.name != "CBLOCK":
+        expected_err(toks, "COMMA", "CBLOCK")
+  # a newline after the closing brace still ends the line
+  toks.advance()
+  if is_dict is False:
+    return ast.SetExpr(vals)
+  return ast.DictExpr(keys, vals)
+
+PREFIX_PARSERS = {
+  "OPAREN": parse_paren,
+  "IDENT": parse_ident,
+  "NUM": parse_num_lit,
+  "BOOL": parse_bool_lit,
+  "STRING": parse_string_lit,
+  "OLIST": parse_list,
+  "OBLOCK": parse_dict_or_set,
+}
+
+# END EXPRESSIONS
+
+def parse_line(toks):
+  pos = start_pos(toks)
+  name = toks.tok.name
+  if name == "OBLOCK":
     toks.advance()
-    return ast.Suite(lines)
+    lines = list(parse_lines(toks, "CBLOCK"))
+    if toks.tok.name != "CBLOCK":
+      expected_err(toks, "CBLOCK")
+    toks.advance()
+    return ast.Suite(lines, pos)
 
-  elif toks.tok.name == "IF":
+  elif name == "IF":
     return parse_if_clause(toks)
   
-  elif toks.tok.name == "WHILE":
+  elif name == "WHILE":
     return parse_while_clause(toks)
   
-  elif toks.tok.name == "FUNC":
+  elif name == "FOR":
+    return parse_for_clause(toks)
+  
+  elif name == "FUNC":
     return parse_func_def(toks)
   
-  elif toks.tok.name == "RETURN":
+  elif name == "RETURN":
     toks.advance()
-    return ast.ReturnLine(parse_expr(toks))
+    return ast.ReturnLine(parse_expr(toks), pos)
   
-  toks_copy = toks.copy()
-  try:
-    assignment = parse_assign(toks_copy)
-  except SyntaxError:
-    return ast.ExprLine(parse_expr(toks))
-  else:
-    toks.replace_with(toks_copy)
-    return assignment
+  elif name == "IDENT":
+    # an assignment is IDENT = or IDENT op=, anything else is an
+    # expression
+    next_name = toks.peek().name
+    if next_name == "EQUAL" or (next_name in OPS
+                                and toks.peek(2).name == "EQUAL"):
+      return parse_assign(toks)
+
+  return ast.ExprLine(parse_expr(toks), pos)
+
+def parse_lines(toks, end):
+  """Yields the lines up to an end token, leaving it as the current token.
+
+  If toks.errors is a list, a syntax error in a line is added to it and
+  parsing carries on from the next line.
+  """
+  while True:
+    name = toks.tok.name
+    if name == "NEWLINE":
+      toks.advance()
+      continue
+    elif name == end or name == "EOF":
+      return
+
+    start = toks.ind
+    try:
+      line = parse_line(toks)
+      if toks.tok.name not in {"NEWLINE", end}:
+        expected_err(toks, "NEWLINE", end)
+    except SyntaxError as err:
+      if toks.errors is None:
+        raise
+      toks.errors.append(err)
+      skip_line(toks)
+      if toks.ind == start:
+        toks.advance()
+      continue
+    yield line
+
+def skip_line(toks):
+  """Advances to the end of the current line, skipping nested blocks."""
+  depth = 0
+  while toks.tok.name != "EOF":
+    name = toks.tok.name
+    if name == "OBLOCK":
+      depth += 1
+    elif name == "CBLOCK":
+      if not depth:
+        return
+      depth -= 1
+    elif name == "NEWLINE" and not depth:
+      return
+    toks.advance()
 
 def parse_if_clause(toks):
+  pos = start_pos(toks)
   clauses = []
-  while toks.tok.name == "IF":
+  while True:
     toks.advance()
     cond = parse_expr(toks)
     stmt = parse_line(toks)
     clauses.append((cond, stmt))
-    if toks.tok.name == "EOF":
-      return ast.IfLine(clauses)
-    elif toks.tok.name == "NEWLINE":
-      toks.advance()
-    else:
-      expected_err(toks, "NEWLINE", "EOF")
-    
-    if toks.tok.name == "ELSE":
+
+    # else may follow on the same line or on the next one
+    if toks.tok.name == "NEWLINE" and toks.peek().name == "ELSE":
       toks.advance()
-    else:
-      return ast.IfLine(clauses)
+    if toks.tok.name != "ELSE":
+      return ast.IfLine(clauses, pos)
+    toks.advance()
+
+    if toks.tok.name != "IF":
+      break
+
   cond = ast.BoolLit(val=True)
   stmt = parse_line(toks)
   clauses.append((cond, stmt))
-  if toks.tok.name in {"NEWLINE", "EOF"}:
-    toks.advance()
-  else:
-    expected_err(toks, "NEWLINE", "EOF")
-  
-  return ast.IfLine(clauses)
+  return ast.IfLine(clauses, pos)
 
 def parse_while_clause(toks):
+  pos = start_pos(toks)
   toks.advance()
 
   cond = parse_expr(toks)
   stmt = parse_line(toks)
-  if toks.tok.name in {"NEWLINE", "EOF"}:
-    return ast.WhileLine(cond, stmt)
-  else:
-    expected_err(toks, "NEWLINE", "EOF")
+  return ast.WhileLine(cond, stmt, pos)
+
+def parse_for_clause(toks):
+  pos = start_pos(toks)
+  toks.advance()
+
+  if toks.tok.name != "IDENT":
+    expected_err(toks, "IDENT")
+  name = toks.advance().text
+  if toks.tok.name != "CONTAINED":
+    expected_err(toks, "CONTAINED")
+  toks.advance()
+
+  iter_ = parse_expr(toks)
+  stmt = parse_line(toks)
+  return ast.ForLine(name, iter_, stmt, pos=pos)
 
 def parse_func_def(toks):
+  pos = start_pos(toks)
   toks.advance()
 
   if toks.tok.name == "IDENT":
@@ -338,7 +377,6 @@ def parse_func_def(toks):
 
   if toks.tok.name != "OPAREN":
     expected_err(toks, "OPAREN")
-    toks.advance()
   
   arg_names = []
 
@@ -359,40 +397,43 @@ def parse_func_def(toks):
   toks.advance()
 
   line = parse_line(toks)
-
-  if toks.tok.name in {"NEWLINE", "EOF"}:
-    return ast.FuncLine(name, arg_names, line)
-  else:
-    expected_err(toks, "NEWLINE", "EOF")
+  return ast.FuncLine(name, arg_names, line, pos=pos)
   
 def parse_assign(toks):
   op = None
-  if toks.tok.name == "IDENT":
-    name = toks.advance().text
-    if toks.tok.name in OPS:
-      op = toks.advance().name
-    
-    if toks.tok.name == "EQUAL":
-      toks.advance()
-      expr = parse_expr(toks)
-      if op:
-        expr = ast.BinExpr(op, ast.IdentExpr(name), expr)
-      return ast.SetLine(name, expr)
-    else:
-      expected_err(toks, "EQUAL")
-  else:
-    expected_err(toks, "IDENT")
-
-
-def parse(toks):
-  lines = []
-  while toks.tok.name != "EOF":
-    if toks.tok.name == "NEWLINE":
-      toks.advance()
-      continue
-
-    lines.append(parse_line(toks))
-    if toks.tok.name not in {"NEWLINE", "EOF"}:
-      expected_err(toks, "NEWLINE", "EOF")
-    toks.advance()
-  return lines
\ No newline at end of file
+  pos = start_pos(toks)
+  name = toks.advance().text
+  if toks.tok.name in OPS:
+    op = toks.advance().name
+  
+  toks.advance()
+  expr = parse_expr(toks)
+  if op:
+    expr = ast.BinExpr(op, ast.IdentExpr(name), expr)
+  return ast.SetLine(name, expr, pos=pos)
+
+class SyntaxErrors(SyntaxError):
+  """All the syntax errors found while parsing with recover=True."""
+  def __init__(self, errors):
+    super().__init__("\n\n".join(str(err) for err in errors))
+    self.errors = errors
+
+def iter_parse(toks, recover=False, resolver=None):
+  """Yields each top level line as soon as it has been parsed.
+
+  Lines are passed through resolver, a new Resolver by default, so the
+  names in them know their slots. With recover=True, syntax errors do
+  not stop parsing. They are all raised together as SyntaxErrors once
+  the source has been read.
+  """
+  if resolver is None:
+    resolver = Resolver()
+  if recover:
+    toks.errors = []
+  for line in parse_lines(toks, "EOF"):
+    yield resolver.resolve(line)
+  if toks.errors:
+    raise SyntaxErrors(toks.errors)
+
+def parse(toks, recover=False, resolver=None):
+  return list(iter_parse(toks, recover, resolver))
@@ -0,0 +1,189 @@
+import PowerScriptast as ast
+from PowerScriptattrcache import AttrCache
+
+# Frames are lists with a slot for every name their code uses. Calling a
+# function copies the slots of the frame it was defined in, as they are
+# at call time, which is how the dict scopes this replaces behaved, so
+# every name a function uses also gets a slot in the frames around it. A
+# name is then found at (slot in this frame, slot in the global frame,
+# whether the slot holds a Cell), or is None for a builtin, which always
+# wins like it did when builtins were checked first.
+#
+# A function defined in the global frame copies its slots straight from
+# it. One defined in another function only keeps the slots it uses, when
+# it is defined. A slot the defining function sets again afterwards has
+# to be seen by later calls, so it is kept in a Cell both frames share.
+
+class Unbound():
+  def __repr__(self):
+    return "UNBOUND"
+
+# the value of a slot whose name has not been set
+UNBOUND = Unbound()
+
+class Cell():
+  """A slot value shared with the functions defined in its frame."""
+  __slots__ = ("val",)
+
+  def __init__(self, val):
+    self.val = val
+
+_builtin_names = None
+
+def builtin_names():
+  """Returns the names of the default builtins."""
+  global _builtin_names
+  if _builtin_names is None:
+    # imported here since the builtins need the objects module, which
+    # needs the parser and so this module
+    import PowerScriptbuiltins
+    _builtin_names = frozenset(PowerScriptbuiltins.builtins)
+  return _builtin_names
+
+class Scope():
+  """The slots of one frame, which also gives them to outer frames.
+
+  assigned holds the slots that lines in the frame itself set, and
+  captured the ones functions defined in it use.
+  """
+  def __init__(self, parent=None):
+    self.parent = parent
+    self.names = []
+    self.slots = {}
+    self.assigned = set()
+    self.captured = set()
+
+  @property
+  def cells(self):
+    return self.assigned & self.captured
+
+  def slot(self, name):
+    slot = self.slots.get(name)
+    if slot is None:
+      slot = self.slots[name] = len(self.names)
+      self.names.append(name)
+      if self.parent is not None:
+        self.parent.slot(name)
+    return slot
+
+class Resolver():
+  """Fills in where each name of a script's lines is found.
+
+  Each attribute lookup also gets its own AttrCache.
+
+  Lines are resolved one at a time as they are parsed, so global_names,
+  the names of the global frame's slots, grows as a streamed script is
+  read. Each line is walked twice: once to find the slots of every frame
+  and which of them are cells, then again to fill them in.
+  """
+  def __init__(self, builtins=None):
+    self.builtins = builtin_names() if builtins is None else builtins
+    self.globals = Scope()
+    self.global_names = self.globals.names
+
+  def resolve(self, line):
+    scopes = {}
+    self.collect(line, self.globals, scopes)
+    return self.resolve_node(line, self.globals, scopes)
+
+  def collect(self, node, scope, scopes):
+    """Finds the slots of scope and of the functions in node.
+
+    The Scope of each FuncLine is put in scopes under the node's id.
+    """
+    if isinstance(node, ast.IdentExpr):
+      if node.ident not in self.builtins:
+        scope.slot(node.ident)
+
+    elif isinstance(node, ast.SetLine):
+      self.collect(node.expr, scope, scopes)
+      if node.name not in self.builtins:
+        scope.assigned.add(scope.slot(node.name))
+
+    elif isinstance(node, ast.ForLine):
+      self.collect(node.iter, scope, scopes)
+      if node.name not in self.builtins:
+        scope.assigned.add(scope.slot(node.name))
+      self.collect(node.line, scope, scopes)
+
+    elif isinstance(node, ast.FuncLine):
+      if node.name not in self.builtins:
+        scope.assigned.add(scope.slot(node.name))
+      func_scope = scopes[id(node)] = Scope(scope)
+      for name in node.arg_names:
+        func_scope.slot(name)
+      self.collect(node.line, func_scope, scopes)
+      if scope is not self.globals:
+        scope.captured.update(scope.slots[name] for name in func_scope.names)
+
+    elif isinstance(node, tuple) and hasattr(node, "_fields"):
+      for field in node._fields:
+        self.collect(getattr(node, field), scope, scopes)
+
+    elif isinstance(node, (list, tuple)):
+      for item in node:
+        self.collect(item, scope, scopes)
+
+  def ref(self, name, scope):
+    if name in self.builtins:
+      return None
+    slot = scope.slots[name]
+    cell = slot in scope.assigned and slot in scope.captured
+    return (slot, self.globals.slots[name], cell)
+
+  def resolve_node(self, node, scope, scopes):
+    if isinstance(node, ast.IdentExpr):
+      return node._replace(slot=self.ref(node.ident, scope))
+
+    elif isinstance(node, ast.SetLine):
+      expr = self.resolve_node(node.expr, scope, scopes)
+      return node._replace(expr=expr, slot=self.ref(node.name, scope))
+
+    elif isinstance(node, ast.ForLine):
+      iter_ = self.resolve_node(node.iter, scope, scopes)
+      line = self.resolve_node(node.line, scope, scopes)
+      return node._replace(iter=iter_, line=line,
+                           slot=self.ref(node.name, scope))
+
+    elif isinstance(node, ast.FuncLine):
+      func_scope = scopes[id(node)]
+      line = self.resolve_node(node.line, func_scope, scopes)
+      return node._replace(line=line,
+                           slot=self.ref(node.name, scope),
+                           layout=self.layout(node, func_scope))
+
+    elif isinstance(node, tuple) and hasattr(node, "_fields"):
+      node = node._replace(**{
+        field: self.resolve_node(getattr(node, field), scope, scopes)
+        for field in node._fields if field != "pos"
+      })
+      if isinstance(node, (ast.DotExpr, ast.ColonCallExpr)):
+        node = node._replace(cache=AttrCache(node.name))
+      return node
+
+    elif isinstance(node, list):
+      return [self.resolve_node(item, scope, scopes) for item in node]
+
+    elif isinstance(node, tuple):
+      return tuple(self.resolve_node(item, scope, scopes) for item in node)
+
+    else:
+      return node
+
+  def layout(self, node, func_scope):
+    """Returns how calls of a function make their frame.
+
+    This is (captures, derefs, arg_slots, cells, nested). Slot i of the
+    frame starts as slot captures[i] of the defining frame, which is
+    read from a Cell if i is in derefs. nested says whether the function
+    is defined in another function, in which case the captured slots
+    are kept when it is defined rather than read when it is called.
+    """
+    scope = func_scope.parent
+    captures = tuple(scope.slots[name] for name in func_scope.names)
+    scope_cells = scope.cells
+    derefs = tuple(slot for slot, capture in enumerate(captures)
+                   if capture in scope_cells)
+    arg_slots = tuple(func_scope.slots[name] for name in node.arg_names)
+    cells = tuple(sorted(func_scope.cells))
+    return (captures, derefs, arg_slots, cells, scope is not self.globals)
@@ -0,0 +1,90 @@
+import bisect
+import collections
+
+# how many source lines a streamed SourceMap keeps the text of
+RECENT_LINES = 16
+
+class SourceMap():
+  """Maps source indexes to line numbers and columns.
+
+  line_starts holds the index each line starts at, so finding the line
+  of an index is a binary search. For a source string the table is built
+  the first time it is needed. For a streamed source the tokenizer adds
+  lines as it reads them, and only the most recent lines keep their text.
+  """
+  def __init__(self, code=None):
+    self.code = code
+    self._line_starts = None if code is not None else [0]
+    self.recent_lines = collections.deque(maxlen=RECENT_LINES)
+    self.size = 0 if code is None else len(code)
+
+  @property
+  def line_starts(self):
+    if self._line_starts is None:
+      starts = [0]
+      find = self.code.find
+      ind = find("\n")
+      while ind != -1:
+        starts.append(ind + 1)
+        ind = find("\n", ind + 1)
+      self._line_starts = starts
+    return self._line_starts
+
+  def add_line(self, start, line):
+    if start:
+      self._line_starts.append(start)
+    self.recent_lines.append((len(self._line_starts), line))
+    self.size = start + len(line)
+
+  def line_pos(self, ind):
+    """Returns (line number, column) for a source index.
+
+    A negative index stands for the end of the source.
+    """
+    if ind < 0:
+      ind = self.size
+    line_starts = self.line_starts
+    line_no = bisect.bisect_right(line_starts, ind)
+    return line_no, ind - line_starts[line_no - 1]
+
+  def line_text(self, line_no):
+    if self.code is not None:
+      start = self.line_starts[line_no - 1]
+      end = self.code.find("\n", start)
+      if end == -1:
+        end = len(self.code)
+      return self.code[start:end]
+
+    for recent_no, line in self.recent_lines:
+      if recent_no == line_no:
+        return line.rstrip("\n")
+    return ""
+
+  def describe(self, ind):
+    line_no, pos = self.line_pos(ind)
+    line = self.line_text(line_no)
+    marker = " " * pos + "^"
+    return f"line {line_no}:\n{line}\n{marker}"
+
+class FileSourceMap(SourceMap):
+  """A SourceMap for a script file, which is only read once needed.
+
+  Scripts run from a cached parse have no source in memory, and most of
+  them never need a position looked up.
+  """
+  def __init__(self, path):
+    self.path = path
+    self._code = None
+    self._line_starts = None
+    self.recent_lines = collections.deque(maxlen=RECENT_LINES)
+
+  @property
+  def code(self):
+    if self._code is None:
+      with open(self.path) as f:
+        self._code = f.read()
+    return self._code
+
+  @property
+  def size(self):
+    return len(self.code)
@@ -1,18 +1,28 @@
 import re
 import collections
 import contextlib
+import weakref
 
+from PowerScriptsourcemap import SourceMap
+
+# All tokens are matched by a single alternation, which takes the first
+# alternative that matches rather than the longest. The order below is
+# therefore significant: an operator must come before any operator that
+# is a prefix of it, and keywords must come before IDENT. Given that
+# ordering, the first match is the maximal munch and ties go to the
+# earlier entry.
 TOKENS = [
   # keywords:
-  ("BOOLAND", r"(and)(?:\W|$)", 1),
-  ("BOOLOR", r"(or)(?:\W|$)", 1),
-  ("BOOLNOT", r"(not)(?:\W|$)", 1),
-  ("IF", r"(if)(?:\W|$)", 1),
-  ("ELSE", r"(else)(?:\W|$)", 1),
-  ("WHILE", r"(while)(?:\W|$)", 1),
-  ("FUNC", r"(func)(?:\W|$)", 1),
-  ("RETURN", r"(return)(?:\W|$)", 1),
-  ("BOOL", r"(true|false)(?:\W|$)", 1),
+  ("BOOLAND", r"and(?=\W|$)"),
+  ("BOOLOR", r"or(?=\W|$)"),
+  ("BOOLNOT", r"not(?=\W|$)"),
+  ("IF", r"if(?=\W|$)"),
+  ("ELSE", r"else(?=\W|$)"),
+  ("WHILE", r"while(?=\W|$)"),
+  ("FOR", r"for(?=\W|$)"),
+  ("FUNC", r"func(?=\W|$)"),
+  ("RETURN", r"return(?=\W|$)"),
+  ("BOOL", r"(?:true|false)(?=\W|$)"),
 
   # other:
   ("COMMA", r","),
@@ -25,6 +35,8 @@ TOKENS = [
   ("NEQ", r"!="),
   ("LEQ", r"<="),
   ("GEQ", r">="),
+  ("LSHIFT", r"<<"),
+  ("RSHIFT", r">>"),
   ("LT", r"<"),
   ("GT", r">"),
 
@@ -33,9 +45,8 @@ TOKENS = [
   ("SUB", r"-"),
   ("MUL", r"\*"),
   ("DIV", r"/"),
+  ("MOD", r"%"),
 
-  ("LSHIFT", r"<<"),
-  ("RSHIFT", r">>"),
   ("AND", r"&"),
   ("OR", r"\|"),
   ("XOR", r"\^"),
@@ -56,34 +67,81 @@ TOKENS = [
 
   # special:
   ("NEWLINE", r"\n"),
-]  # lists are guaranteed ordered, but dicts arent in 3.6
+]
 
-MATCH_PRIORITY = {name: ind for ind, (name, *_)
-                  in enumerate(TOKENS)}
+WHITESPACE = r"[ \t\f]+"
 
-KEYWORDS = {
-  "BOOLAND",
-  "BOOLOR",
-  "BOOLNOT",
-  "IF",
-  "ELSE",
-  "FUNC",
-}
+MASTER = re.compile("|".join(
+  [f"(?P<{name}>{regex})" for name, regex in TOKENS]
+  + [f"(?P<_WHITESPACE>{WHITESPACE})", "(?P<_ERROR>.)"]
+))
 
-TOKENS = [
-  (name, re.compile(val), *group)
-  for name, val, *group in TOKENS
-]
+Token = collections.namedtuple("Token", "name text ind")
 
-WHITESPACE = re.compile("[ \t\f]+")
+EOF_TOKEN = Token("EOF", "", -1)
 
-Token = collections.namedtuple("Token", "name text ind")
+# how many tokens the buffer may hold before it drops the ones that no
+# TokenStream can reach anymore
+BUFFER_SIZE = 256
+
+class TokenBuffer():
+  """Tokens pulled on demand from a token iterator.
+
+  Every TokenStream reading from the buffer is tracked, so tokens behind
+  the earliest of them can be dropped. Backtracking with copy() therefore
+  keeps only the tokens between the copy and the furthest lookahead.
+  """
+  def __init__(self, tokens):
+    self._tokens = tokens
+    self._streams = weakref.WeakSet()
+    self.buf = []
+    self.base = 0
+  
+  def track(self, stream):
+    self._streams.add(stream)
+  
+  def __getitem__(self, ind):
+    buf = self.buf
+    while ind - self.base >= len(buf):
+      if self._tokens is None:
+        return EOF_TOKEN
+      if len(buf) >= BUFFER_SIZE:
+        self._trim()
+        buf = self.buf
+      try:
+        buf.append(next(self._tokens))
+      except StopIteration:
+        self._tokens = None
+    return buf[ind - self.base]
+  
+  def _trim(self):
+    low = min((stream.ind for stream in self._streams),
+              default=self.base + len(self.buf))
+    drop = low - self.base
+    if drop > 0:
+      del self.buf[:drop]
+      self.base = low
 
 class TokenStream():
+  """A cursor over the tokens of some PowerScript source.
+
+  code is either the whole source as a string, or a file object or any
+  other iterable of string chunks, which is read lazily as tokens are
+  needed.
+  """
   def __init__(self, code):
     self._ignore = collections.Counter()
-    self.code = code
-    self.tokens = list(_tokenize(code))
+    if isinstance(code, str):
+      self.code = code
+      self.source_map = SourceMap(code)
+      tokens = _tokenize(code)
+    else:
+      self.code = None
+      self.source_map = SourceMap()
+      tokens = _tokenize_chunks(code, self.source_map)
+    self.tokens = TokenBuffer(tokens)
+    self.tokens.track(self)
+    self.errors = None
     self.ind = -1
     self.tok = None
     self.advance()
@@ -97,8 +155,10 @@ class TokenStream():
   @contextlib.contextmanager
   def ignorectx(self, name):
     self.ignore(name)
-    yield
-    self.unignore(name)
+    try:
+      yield
+    finally:
+      self.unignore(name)
   
   def ignored(self, name):
     return bool(self._ignore[name])
@@ -106,10 +166,7 @@ class TokenStream():
   def _advance(self):
     tok = self.tok
     self.ind += 1
-    try:
-      self.tok = self.tokens[self.ind]
-    except IndexError:
-      self.tok = Token("EOF", "", -1)
+    self.tok = self.tokens[self.ind]
     return tok
   
   def advance(self):
@@ -118,13 +175,27 @@ class TokenStream():
       res = self._advance()
     return res
   
+  def peek(self, count=1):
+    """Returns the token count places ahead without advancing."""
+    ind = self.ind
+    tok = self.tok
+    while count:
+      ind += 1
+      tok = self.tokens[ind]
+      if not self.ignored(tok.name):
+        count -= 1
+    return tok
+  
   def copy(self):
     ts = object.__new__(TokenStream)
     ts.code = self.code
+    ts.source_map = self.source_map
     ts.tokens = self.tokens
     ts.ind = self.ind
     ts.tok = self.tok
     ts._ignore = self._ignore.copy()
+    ts.errors = self.errors
+    ts.tokens.track(ts)
     return ts
   
   def replace_with(self, ts):
@@ -132,41 +203,38 @@ class TokenStream():
     self.ind = ts.ind
     self.tok = ts.tok
     self._ignore = ts._ignore
-
-def _tokenize(code):
-  curr_ind = 0
-  while curr_ind < len(code):
-    matches = set()
-    for name, regex, *group in TOKENS:
-      if group:
-        group = group[0]
-      else:
-        group = 0
-      
-      match = regex.match(code, pos=curr_ind)
-      if match:
-        matches.add((name, match, group))
-
-    if matches:
-      if KEYWORDS & matches:
-        return (KEYWORDS & matches).pop() # no keyword conflicts
-      else:
-        # select longest token; maximum munch rule
-        def match_len(match):
-          return (
-            len(match[1].group(match[2])),
-            -MATCH_PRIORITY[match[0]]
-          )
-        name, match, group = max(matches, key=match_len)
-        
-        curr_ind = match.end(group)
-        yield Token(name=name, text=match.group(group), ind=curr_ind)
-
-    else:
-      match = WHITESPACE.match(code, pos=curr_ind)
-      if match:
-        curr_ind = match.end()
-      else:
-        err = (f"Unexpected char at index {curr_ind}: "
-               f"{code[curr_ind]!r}")
-        raise SyntaxError(err)
\ No newline at end of file
+    self.tokens.track(self)
+
+def _tokenize(code, offset=0):
+  for match in MASTER.finditer(code):
+    name = match.lastgroup
+    if name == "_WHITESPACE":
+      continue
+    elif name == "_ERROR":
+      curr_ind = match.start()
+      err = (f"Unexpected char at index {curr_ind + offset}: "
+             f"{code[curr_ind]!r}")
+      raise SyntaxError(err)
+    yield Token(name, match.group(), match.end() + offset)
+
+def _tokenize_chunks(chunks, source_map):
+  # no token spans a newline, so each complete line can be tokenized on
+  # its own
+  offset = 0
+  pending = []
+  for chunk in chunks:
+    pending.append(chunk)
+    if "\n" not in chunk:
+      continue
+    lines = "".join(pending).split("\n")
+    pending = [lines.pop()]
+    for line in lines:
+      line += "\n"
+      source_map.add_line(offset, line)
+      yield from _tokenize(line, offset)
+      offset += len(line)
+  
+  line = "".join(pending)
+  if line:
+    source_map.add_line(offset, line)
+    yield from _tokenize(line, offset)
@@ -0,0 +1,349 @@
+import PowerScriptast as ast
+import PowerScriptobjects as objs
+import PowerScriptexec
+from PowerScriptresolver import UNBOUND
+from PowerScriptattrcache import call_method
+
+# Parsed lines are lowered to the source of a Python module with one
+# function per suite, which compile() turns into CPython bytecode. The
+# generated code reads names from the frame's slots and goes through the
+# PowerScriptobjects functions for every operation, so it behaves exactly
+# like the tree walker. Anything it can't lower is handed to the tree
+# walker as an AST constant.
+
+FILENAME = "<powerscript>"
+
+def compare(env, funcs, vals):
+  """Runs a chain of comparisons, like a < b <= c, on evaluated vals."""
+  for func, lval, rval in zip(funcs, vals, vals[1:]):
+    if not objs.make_bool(func(lval, env, [lval, rval])).val:
+      return objs.bool_from_py_bool(False)
+  return objs.bool_from_py_bool(True)
+
+def run_body(env, body):
+  body(env)
+
+_base_namespace = None
+
+def base_namespace():
+  """Returns the names every generated module can use.
+
+  The objects module imports this one through PowerScriptexec before it
+  is done, so they are only looked up the first time they are needed.
+  """
+  global _base_namespace
+  if _base_namespace is None:
+    _base_namespace = {
+      "PowerScriptError": objs.PowerScriptError,
+      "UNBOUND": UNBOUND,
+      "RETURN": PowerScriptexec.RETURN,
+      "make_bool": objs.make_bool,
+      "call": objs.call,
+      "list_from_py_list": objs.list_from_py_list,
+      "dict_from_py_pairs": objs.dict_from_py_pairs,
+      "set_from_py_list": objs.set_from_py_list,
+      "py_iter": objs.py_iter,
+      "make_func": objs.make_func,
+      "true": objs.bool_from_py_bool(True),
+      "false": objs.bool_from_py_bool(False),
+      "call_method": call_method,
+      "compare": compare,
+      "run_body": run_body,
+      "exec_line": PowerScriptexec.exec_line,
+      "eval_expr": PowerScriptexec.eval_expr,
+    }
+  return _base_namespace
+
+class Lowering():
+  """The Python source for a list of lines, built up a line at a time.
+
+  Each suite becomes a function whose lines are kept in funcs once it is
+  finished. consts holds the objects the source refers to by name.
+  """
+  def __init__(self):
+    self.funcs = []
+    self.out = None
+    self.out_poses = None
+    self.consts = {}
+    self._const_names = {}
+    self.temps = 0
+
+  def write(self, indent, text, pos=None):
+    if pos is not None:
+      self.out_poses.append((len(self.out), pos))
+    self.out.append("  " * indent + text)
+
+  def const(self, val, key=None):
+    """Returns the name of a constant, sharing it with equal keys."""
+    if key is not None and key in self._const_names:
+      return self._const_names[key]
+    name = f"_c{len(self.consts)}"
+    self.consts[name] = val
+    if key is not None:
+      self._const_names[key] = name
+    return name
+
+  def temp(self):
+    self.temps += 1
+    return f"_t{self.temps}"
+
+  def source(self):
+    """Returns (source, poses) for every function written.
+
+    poses maps a line number of the source to the position of the
+    PowerScript line it came from, for tracebacks.
+    """
+    out = []
+    poses = {}
+    for func_out, func_poses in self.funcs:
+      for ind, pos in func_poses:
+        poses[len(out) + ind + 1] = pos
+      out.extend(func_out)
+    return "\n".join(out) + "\n", poses
+
+  def lower_func(self, lines):
+    """Writes a function running lines, and returns its name."""
+    outer = self.out, self.out_poses
+    self.out = []
+    self.out_poses = []
+    self.write(0, "")
+    self.write(1, "frame = env.stack[-1]")
+    self.write(1, "get_var = env.get_var")
+    self.write(1, "set_var = env.set_var")
+    self.write(1, "try:")
+    start = len(self.out)
+    for line in lines:
+      self.lower_line(2, line)
+    if len(self.out) == start:
+      self.write(2, "pass")
+    self.write(1, "except PowerScriptError as err:")
+    self.write(2, "pos = _poses.get(err.__traceback__.tb_lineno)")
+    self.write(2, "err.add_frame(len(env.stack), env.source_map, pos)")
+    self.write(2, "raise")
+    # functions nested in this one are finished first, so the name is
+    # only known now
+    name = f"_suite{len(self.funcs)}"
+    self.out[0] = f"def {name}(env):"
+    self.funcs.append((self.out, self.out_poses))
+    self.out, self.out_poses = outer
+    return name
+
+  def lower_expr(self, expr):
+    if isinstance(expr, ast.IdentExpr):
+      if expr.slot is None:
+        return f"get_var({expr.ident!r}, None)"
+      local, _, cell = expr.slot
+      val = f"frame[{local}].val" if cell else f"frame[{local}]"
+      temp = self.temp()
+      return (f"({temp} if ({temp} := {val}) is not UNBOUND "
+              f"else get_var({expr.ident!r}, {expr.slot!r}))")
+
+    elif isinstance(expr, ast.NumLit):
+      val = objs.num_from_py_num(expr.val)
+      return self.const(val, (type(expr.val), expr.val))
+
+    elif isinstance(expr, ast.BinExpr):
+      left = self.lower_expr(expr.left)
+      right = self.lower_expr(expr.right)
+      temp = self.temp()
+      if expr.op == "BOOLAND":
+        return f"({right} if make_bool({temp} := {left}).val else {temp})"
+      elif expr.op == "BOOLOR":
+        return f"({temp} if make_bool({temp} := {left}).val else {right})"
+      func = self.const(PowerScriptexec.BIN_OPS[expr.op], expr.op)
+      return f"{func}(({temp} := {left}), env, [{temp}, {right}])"
+
+    elif isinstance(expr, ast.CmpExpr):
+      vals = [self.lower_expr(val) for val in expr.vals]
+      if len(expr.ops) == 1:
+        func = self.const(PowerScriptexec.CMP_OPS[expr.ops[0]], expr.ops[0])
+        left, right = vals
+        temp = self.temp()
+        return (f"(true if make_bool({func}(({temp} := {left}), env, "
+                f"[{temp}, {right}])).val else false)")
+      funcs = tuple(PowerScriptexec.CMP_OPS[op] for op in expr.ops)
+      funcs = self.const(funcs, tuple(expr.ops))
+      return f"compare(env, {funcs}, [{', '.join(vals)}])"
+
+    elif isinstance(expr, ast.CallExpr):
+      args = [self.lower_expr(arg) for arg in expr.args]
+      func = self.lower_expr(expr.func)
+      func_temp = self.temp()
+      if not args:
+        return f"call(({func_temp} := {func}), env, [{func_temp}])"
+      # the arguments are evaluated before the function, as in exec_line
+      args_temp = self.temp()
+      return (f"(({args_temp} := [{', '.join(args)}]), "
+              f"({func_temp} := {func})) and "
+              f"call({func_temp}, env, [{func_temp}] + {args_temp})")
+
+    elif isinstance(expr, ast.ColonCallExpr):
+      val = self.lower_expr(expr.expr)
+      args = [self.lower_expr(arg) for arg in expr.args]
+      cache = self.const(expr.cache)
+      val_temp = self.temp()
+      method_temp = self.temp()
+      call_args = ", ".join([f"{method_temp}[0]", val_temp] + args)
+      return (f"call_method(env, ({method_temp} := {cache}.lookup("
+              f"({val_temp} := {val}))), [{call_args}])")
+
+    elif isinstance(expr, ast.UnaryExpr):
+      val = self.lower_expr(expr.val)
+      func = self.const(PowerScriptexec.UNARY_OPS[expr.op], ("unary", expr.op))
+      temp = self.temp()
+      return f"{func}(({temp} := {val}), env, [{temp}])"
+
+    elif isinstance(expr, ast.DotExpr):
+      cache = self.const(expr.cache)
+      return f"{cache}.lookup({self.lower_expr(expr.val)})[0]"
+
+    elif isinstance(expr, ast.ListExpr):
+      elems = [self.lower_expr(elem) for elem in expr.vals]
+      return f"list_from_py_list([{', '.join(elems)}])"
+
+    elif isinstance(expr, ast.DictExpr):
+      pairs = [f"({self.lower_expr(key)}, {self.lower_expr(val)})"
+               for key, val in zip(expr.keys, expr.vals)]
+      return f"dict_from_py_pairs(env, [{', '.join(pairs)}])"
+
+    elif isinstance(expr, ast.SetExpr):
+      elems = [self.lower_expr(elem) for elem in expr.vals]
+      return f"set_from_py_list(env, [{', '.join(elems)}])"
+
+    elif isinstance(expr, ast.BoolLit):
+      return "true" if expr.val else "false"
+
+    elif isinstance(expr, ast.StrLit):
+      val = objs.string_from_py_string(expr.val)
+      return self.const(val, (str, expr.val))
+
+    else:
+      return f"eval_expr(env, {self.const(expr)})"
+
+  def lower_line(self, indent, line):
+    pos = line.pos
+    if isinstance(line, ast.ExprLine):
+      self.write(indent, self.lower_expr(line.expr), pos)
+
+    elif isinstance(line, ast.SetLine):
+      self.lower_set(indent, line.name, line.slot,
+                     self.lower_expr(line.expr), pos)
+
+    elif isinstance(line, ast.IfLine):
+      keyword = "if"
+      for cond, stmt in line.cond_codes:
+        cond = self.lower_expr(cond)
+        self.write(indent, f"{keyword} make_bool({cond}).val:", pos)
+        self.lower_block(indent + 1, stmt)
+        keyword = "elif"
+
+    elif isinstance(line, ast.WhileLine):
+      cond = self.lower_expr(line.cond)
+      self.write(indent, f"while make_bool({cond}).val:", pos)
+      self.lower_block(indent + 1, line.line)
+
+    elif isinstance(line, ast.ForLine):
+      it = self.lower_expr(line.iter)
+      temp = self.temp()
+      self.write(indent, f"for {temp} in py_iter(env, {it}):", pos)
+      self.lower_set(indent + 1, line.name, line.slot, temp, pos)
+      self.lower_block(indent + 1, line.line)
+
+    elif isinstance(line, ast.FuncLine):
+      body = self.lower_func([line.line])
+      arg_names = self.const(line.arg_names)
+      layout = self.const(line.layout)
+      self.write(indent, f"set_var({line.name!r}, {line.slot!r}, "
+                         f"make_func({arg_names}, {layout}, frame, {body}, "
+                         f"run_body))", pos)
+
+    elif isinstance(line, ast.ReturnLine):
+      val = self.lower_expr(line.val)
+      self.write(indent, f"env.ret_stack[-1] = {val}", pos)
+      self.write(indent, "return RETURN", pos)
+
+    elif isinstance(line, ast.Suite):
+      for sub_line in line.lines:
+        self.lower_line(indent, sub_line)
+
+    else:
+      self.write(indent, f"if exec_line(env, {self.const(line)}) is RETURN:",
+                 pos)
+      self.write(indent + 1, "return RETURN", pos)
+
+  def lower_set(self, indent, name, slot, val, pos):
+    if slot is None or slot[2]:
+      self.write(indent, f"set_var({name!r}, {slot!r}, {val})", pos)
+      return
+    temp = self.temp()
+    local = slot[0]
+    self.write(indent, f"{temp} = {val}", pos)
+    self.write(indent, f"if frame[{local}] is UNBOUND:", pos)
+    self.write(indent + 1, f"set_var({name!r}, {slot!r}, {temp})", pos)
+    self.write(indent, "else:", pos)
+    self.write(indent + 1, f"frame[{local}] = {temp}", pos)
+
+  def lower_block(self, indent, line):
+    start = len(self.out)
+    self.lower_line(indent, line)
+    if len(self.out) == start:
+      self.write(indent, "pass")
+
+def to_python(lines):
+  """Returns (Python source, namespace) for lines.
+
+  Running the source in the namespace defines main, which runs lines
+  when called with an env.
+  """
+  lowering = Lowering()
+  name = lowering.lower_func(list(lines))
+  source, poses = lowering.source()
+  source += f"main = {name}\n"
+  namespace = dict(base_namespace(), _poses=poses, **lowering.consts)
+  return source, namespace
+
+def compile_lines(lines):
+  """Returns a function running lines, or None if they can't be compiled.
+
+  CPython refuses some code, such as blocks nested too deeply, and the
+  tree walker runs those lines instead.
+  """
+  source, namespace = to_python(lines)
+  try:
+    code = compile(source, FILENAME, "exec")
+  except (SyntaxError, RecursionError, MemoryError):
+    return None
+  exec(code, namespace)
+  return namespace["main"]
+
+def exec_suite(env, lines):
+  """Runs top level lines, compiling them to Python first.
+
+  As with the VM, the compiled lines are kept with cached lines and
+  streamed lines are compiled one at a time.
+  """
+  if not isinstance(lines, list):
+    for line in lines:
+      run = compile_lines([line])
+      if run is None:
+        status = PowerScriptexec.exec_line(env, line)
+      else:
+        status = run(env)
+      if status is PowerScriptexec.RETURN:
+        break
+    return
+
+  compiled = getattr(lines, "compiled", None)
+  if compiled is None:
+    run = compile_lines(lines)
+  elif "py" in compiled:
+    run = compiled["py"]
+  else:
+    run = compiled["py"] = compile_lines(lines)
+
+  if run is None:
+    PowerScriptexec.exec_suite(env, lines)
+  else:
+    run(env)
+
+PowerScriptexec.ENGINES["py"] = exec_suite
@@ -0,0 +1,493 @@
+import bisect
+
+import PowerScriptast as ast
+import PowerScriptobjects as objs
+import PowerScriptexec
+from PowerScriptresolver import UNBOUND
+from PowerScriptattrcache import call_method
+from PowerScriptexec import RETURN
+
+# A Code object holds a flat list of (opcode, argument) pairs. The
+# argument of LOAD_CONST, UNARY_OP, BINARY_OP, COMPARE, MAKE_FUNCTION,
+# LOAD_ATTR and LOAD_METHOD indexes consts, where the last two have the
+# AttrCache of their expression.
+# LOAD_NAME and STORE_NAME index refs, which hold (name, slot) for each
+# variable. Jump arguments are positions in ops.
+#
+# Calls of functions the VM compiled don't recurse into run. The caller's
+# code, position and stack are kept in a list and the callee runs in the
+# same loop, so recursion is only limited by memory. A call a function
+# returns straight away replaces the caller's frame instead.
+OPCODES = [
+  "LOAD_NAME",
+  "LOAD_CONST",
+  "STORE_NAME",
+  "BINARY_OP",
+  "COMPARE",
+  "POP_JUMP_IF_FALSE",
+  "JUMP",
+  "FOR_ITER",
+  "CALL",
+  "LOAD_METHOD",
+  "CALL_METHOD",
+  "POP_TOP",
+  "UNARY_OP",
+  "JUMP_IF_FALSE_OR_POP",
+  "JUMP_IF_TRUE_OR_POP",
+  "LOAD_ATTR",
+  "BUILD_LIST",
+  "BUILD_DICT",
+  "BUILD_SET",
+  "GET_ITER",
+  "RETURN_VALUE",
+  "TAIL_CALL",
+  "MAKE_FUNCTION",
+  "END",
+]  # roughly ordered by how often they run, which is the dispatch order
+
+for num, name in enumerate(OPCODES):
+  globals()[name] = num
+
+class Code():
+  def __init__(self):
+    self.ops = []
+    self.consts = []
+    self.refs = []
+    # whether the code is a function body, which ends by returning
+    self.in_func = False
+    self._const_inds = {}
+    self._ref_inds = {}
+    # (position in ops, source index) for the start of every line
+    self.line_starts = []
+    self.line_poses = []
+
+  def emit(self, op, arg=0):
+    self.ops.append(op)
+    self.ops.append(arg)
+    return len(self.ops) - 1
+
+  def patch(self, arg_ind, target=None):
+    self.ops[arg_ind] = len(self.ops) if target is None else target
+
+  def const(self, val, key=None):
+    """Returns the consts index of val, sharing it with equal keys."""
+    if key is None:
+      self.consts.append(val)
+      return len(self.consts) - 1
+    ind = self._const_inds.get(key)
+    if ind is None:
+      self.consts.append(val)
+      ind = self._const_inds[key] = len(self.consts) - 1
+    return ind
+
+  def ref(self, name, slot):
+    ind = self._ref_inds.get((name, slot))
+    if ind is None:
+      self.refs.append((name, slot))
+      ind = self._ref_inds[(name, slot)] = len(self.refs) - 1
+    return ind
+
+  def mark(self, pos):
+    if pos is not None:
+      self.line_starts.append(len(self.ops))
+      self.line_poses.append(pos)
+
+  def pos_at(self, pc):
+    ind = bisect.bisect_right(self.line_starts, pc) - 1
+    if ind < 0:
+      return None
+    return self.line_poses[ind]
+
+# COMPILER
+
+def compile_lines(lines, in_func=False):
+  code = Code()
+  code.in_func = in_func
+  for line in lines:
+    compile_line(code, line)
+  if in_func:
+    code.emit(LOAD_CONST, code.const(objs.PowerScript_none, "none"))
+    code.emit(RETURN_VALUE)
+  else:
+    code.emit(END)
+  return code
+
+def compile_expr(code, expr):
+  if isinstance(expr, ast.IdentExpr):
+    code.emit(LOAD_NAME, code.ref(expr.ident, expr.slot))
+
+  elif isinstance(expr, ast.NumLit):
+    # nums, bools and strings are never mutated, so one object can be
+    # shared by every evaluation of a literal
+    val = objs.num_from_py_num(expr.val)
+    code.emit(LOAD_CONST, code.const(val, (type(expr.val), expr.val)))
+
+  elif isinstance(expr, ast.BinExpr):
+    compile_expr(code, expr.left)
+    if expr.op == "BOOLAND":
+      jump = code.emit(JUMP_IF_FALSE_OR_POP)
+      compile_expr(code, expr.right)
+      code.patch(jump)
+    elif expr.op == "BOOLOR":
+      jump = code.emit(JUMP_IF_TRUE_OR_POP)
+      compile_expr(code, expr.right)
+      code.patch(jump)
+    else:
+      compile_expr(code, expr.right)
+      func = PowerScriptexec.BIN_OPS[expr.op]
+      code.emit(BINARY_OP, code.const(func, expr.op))
+
+  elif isinstance(expr, ast.CmpExpr):
+    for val in expr.vals:
+      compile_expr(code, val)
+    funcs = tuple(PowerScriptexec.CMP_OPS[op] for op in expr.ops)
+    code.emit(COMPARE, code.const(funcs, tuple(expr.ops)))
+
+  elif isinstance(expr, ast.CallExpr):
+    for arg in expr.args:
+      compile_expr(code, arg)
+    compile_expr(code, expr.func)
+    code.emit(CALL, len(expr.args))
+
+  elif isinstance(expr, ast.ColonCallExpr):
+    compile_expr(code, expr.expr)
+    code.emit(LOAD_METHOD, code.const(expr.cache))
+    for arg in expr.args:
+      compile_expr(code, arg)
+    code.emit(CALL_METHOD, len(expr.args))
+
+  elif isinstance(expr, ast.UnaryExpr):
+    compile_expr(code, expr.val)
+    func = PowerScriptexec.UNARY_OPS[expr.op]
+    code.emit(UNARY_OP, code.const(func, ("unary", expr.op)))
+
+  elif isinstance(expr, ast.DotExpr):
+    compile_expr(code, expr.val)
+    code.emit(LOAD_ATTR, code.const(expr.cache))
+
+  elif isinstance(expr, ast.ListExpr):
+    for elem in expr.vals:
+      compile_expr(code, elem)
+    code.emit(BUILD_LIST, len(expr.vals))
+
+  elif isinstance(expr, ast.DictExpr):
+    for key, val in zip(expr.keys, expr.vals):
+      compile_expr(code, key)
+      compile_expr(code, val)
+    code.emit(BUILD_DICT, len(expr.keys))
+
+  elif isinstance(expr, ast.SetExpr):
+    for elem in expr.vals:
+      compile_expr(code, elem)
+    code.emit(BUILD_SET, len(expr.vals))
+
+  elif isinstance(expr, ast.BoolLit):
+    val = objs.bool_from_py_bool(expr.val)
+    code.emit(LOAD_CONST, code.const(val, (bool, expr.val)))
+
+  elif isinstance(expr, ast.StrLit):
+    val = objs.string_from_py_string(expr.val)
+    code.emit(LOAD_CONST, code.const(val, (str, expr.val)))
+
+  else:
+    raise TypeError(f"Unknown expr type {type(expr)}")
+
+def compile_line(code, line):
+  code.mark(line.pos)
+  if isinstance(line, ast.ExprLine):
+    compile_expr(code, line.expr)
+    code.emit(POP_TOP)
+
+  elif isinstance(line, ast.SetLine):
+    compile_expr(code, line.expr)
+    code.emit(STORE_NAME, code.ref(line.name, line.slot))
+
+  elif isinstance(line, ast.IfLine):
+    end_jumps = []
+    for cond, stmt in line.cond_codes:
+      code.mark(line.pos)
+      compile_expr(code, cond)
+      next_jump = code.emit(POP_JUMP_IF_FALSE)
+      compile_line(code, stmt)
+      end_jumps.append(code.emit(JUMP))
+      code.patch(next_jump)
+    for jump in end_jumps:
+      code.patch(jump)
+
+  elif isinstance(line, ast.WhileLine):
+    top = len(code.ops)
+    compile_expr(code, line.cond)
+    end_jump = code.emit(POP_JUMP_IF_FALSE)
+    compile_line(code, line.line)
+    code.emit(JUMP, top)
+    code.patch(end_jump)
+
+  elif isinstance(line, ast.ForLine):
+    # the Python iterator stays on the stack while the loop runs
+    compile_expr(code, line.iter)
+    code.emit(GET_ITER)
+    top = code.emit(FOR_ITER) - 1
+    code.emit(STORE_NAME, code.ref(line.name, line.slot))
+    compile_line(code, line.line)
+    code.emit(JUMP, top)
+    code.patch(top + 1)
+
+  elif isinstance(line, ast.FuncLine):
+    body = compile_lines([line.line], in_func=True)
+    func = (line.arg_names, line.layout, body)
+    code.emit(MAKE_FUNCTION, code.const(func))
+    code.emit(STORE_NAME, code.ref(line.name, line.slot))
+
+  elif isinstance(line, ast.ReturnLine):
+    expr = line.val
+    if code.in_func and isinstance(expr, ast.CallExpr):
+      for arg in expr.args:
+        compile_expr(code, arg)
+      compile_expr(code, expr.func)
+      # only reached if the callee can't replace this frame
+      code.emit(TAIL_CALL, len(expr.args))
+    else:
+      compile_expr(code, expr)
+    code.emit(RETURN_VALUE)
+
+  elif isinstance(line, ast.Suite):
+    for sub_line in line.lines:
+      compile_line(code, sub_line)
+
+  else:
+    raise TypeError(f"Unknown line type {type(line)}")
+
+# END COMPILER
+
+def run(env, code):
+  ops = code.ops
+  consts = code.consts
+  refs = code.refs
+  # a Code object only ever runs in one frame
+  frame = env.stack[-1]
+  stack = []
+  push = stack.append
+  pop = stack.pop
+  make_bool = objs.make_bool
+  pc = 0
+  # (code, pc, stack) of each call below the one running
+  calls = []
+  FuncValue = objs.FuncValue
+  func_attrs = objs.PowerScript_func.attrs
+  call_func = objs.func_attrs["__call"]
+  try:
+    while True:
+      op = ops[pc]
+      arg = ops[pc + 1]
+      pc += 2
+
+      if op == LOAD_NAME:
+        name, slot = refs[arg]
+        if slot is None or slot[2]:
+          push(env.get_var(name, slot))
+        else:
+          val = frame[slot[0]]
+          if val is UNBOUND:
+            val = env.get_var(name, slot)
+          push(val)
+
+      elif op == LOAD_CONST:
+        push(consts[arg])
+
+      elif op == STORE_NAME:
+        name, slot = refs[arg]
+        env.set_var(name, slot, pop())
+
+      elif op == BINARY_OP:
+        right = pop()
+        left = pop()
+        push(consts[arg](left, env, [left, right]))
+
+      elif op == COMPARE:
+        funcs = consts[arg]
+        count = len(funcs) + 1
+        vals = stack[-count:]
+        del stack[-count:]
+        res = True
+        for func, lval, rval in zip(funcs, vals, vals[1:]):
+          if not make_bool(func(lval, env, [lval, rval])).val:
+            res = False
+            break
+        push(objs.bool_from_py_bool(res))
+
+      elif op == POP_JUMP_IF_FALSE:
+        if not make_bool(pop()).val:
+          pc = arg
+
+      elif op == JUMP:
+        pc = arg
+
+      elif op == FOR_ITER:
+        val = next(stack[-1], UNBOUND)
+        if val is UNBOUND:
+          pop()
+          pc = arg
+        else:
+          push(val)
+
+      elif op == CALL:
+        func = pop()
+        if arg:
+          args = stack[-arg:]
+          del stack[-arg:]
+        else:
+          args = []
+        if (type(func) is FuncValue and func.exec_body is run
+            and func_attrs.get("__call") is call_func):
+          calls.append((code, pc, stack))
+          env.add_frame(objs.make_frame(func, args))
+          code = func.line
+          ops = code.ops
+          consts = code.consts
+          refs = code.refs
+          frame = env.stack[-1]
+          stack = []
+          push = stack.append
+          pop = stack.pop
+          pc = 0
+        else:
+          push(objs.call(func, env, [func] + args))
+
+      elif op == LOAD_METHOD:
+        push(consts[arg].lookup(stack[-1]))
+
+      elif op == CALL_METHOD:
+        count = arg + 2
+        args = stack[-count:]
+        del stack[-count:]
+        method = args[1]
+        args[1] = args[0]
+        args[0] = method[0]
+        push(call_method(env, method, args))
+
+      elif op == POP_TOP:
+        pop()
+
+      elif op == UNARY_OP:
+        val = pop()
+        push(consts[arg](val, env, [val]))
+
+      elif op == JUMP_IF_FALSE_OR_POP:
+        if make_bool(stack[-1]).val:
+          pop()
+        else:
+          pc = arg
+
+      elif op == JUMP_IF_TRUE_OR_POP:
+        if make_bool(stack[-1]).val:
+          pc = arg
+        else:
+          pop()
+
+      elif op == LOAD_ATTR:
+        push(consts[arg].lookup(pop())[0])
+
+      elif op == BUILD_LIST:
+        if arg:
+          elems = stack[-arg:]
+          del stack[-arg:]
+        else:
+          elems = []
+        push(objs.list_from_py_list(elems))
+
+      elif op == BUILD_DICT:
+        if arg:
+          elems = stack[-2 * arg:]
+          del stack[-2 * arg:]
+        else:
+          elems = []
+        pairs = zip(elems[::2], elems[1::2])
+        push(objs.dict_from_py_pairs(env, pairs))
+
+      elif op == BUILD_SET:
+        if arg:
+          elems = stack[-arg:]
+          del stack[-arg:]
+        else:
+          elems = []
+        push(objs.set_from_py_list(env, elems))
+
+      elif op == GET_ITER:
+        push(objs.py_iter(env, pop()))
+
+      elif op == RETURN_VALUE:
+        env.ret_stack[-1] = pop()
+        if not calls:
+          return RETURN
+        res = env.remove_frame()
+        code, pc, stack = calls.pop()
+        ops = code.ops
+        consts = code.consts
+        refs = code.refs
+        frame = env.stack[-1]
+        push = stack.append
+        pop = stack.pop
+        push(res)
+
+      elif op == TAIL_CALL:
+        func = pop()
+        if arg:
+          args = stack[-arg:]
+          del stack[-arg:]
+        else:
+          args = []
+        if (type(func) is FuncValue and func.exec_body is run
+            and func_attrs.get("__call") is call_func):
+          frame = env.stack[-1] = objs.make_frame(func, args)
+          code = func.line
+          ops = code.ops
+          consts = code.consts
+          refs = code.refs
+          pc = 0
+        else:
+          push(objs.call(func, env, [func] + args))
+
+      elif op == MAKE_FUNCTION:
+        arg_names, layout, body = consts[arg]
+        push(objs.make_func(arg_names, layout, frame, body, run))
+
+      elif op == END:
+        return
+
+      else:
+        raise ValueError(f"Unknown opcode {op}")
+  except objs.PowerScriptError as err:
+    err.add_frame(len(env.stack), env.source_map, code.pos_at(pc - 2))
+    while calls:
+      env.remove_frame()
+      code, pc, _ = calls.pop()
+      err.add_frame(len(env.stack), env.source_map, code.pos_at(pc - 2))
+    raise
+  except BaseException:
+    for _ in calls:
+      env.remove_frame()
+    raise
+
+def exec_suite(env, lines):
+  """Runs top level lines, compiling them first.
+
+  Compiled code is kept with cached lines, so a script run from the
+  cache is only compiled once. Streamed lines are compiled one at a time.
+  """
+  if not isinstance(lines, list):
+    for line in lines:
+      if run(env, compile_lines([line])) is RETURN:
+        break
+    return
+
+  compiled = getattr(lines, "compiled", None)
+  if compiled is None:
+    run(env, compile_lines(lines))
+    return
+
+  code = compiled.get("vm")
+  if code is None:
+    code = compiled["vm"] = compile_lines(lines)
+  run(env, code)
+
+PowerScriptexec.ENGINES["vm"] = exec_suite
@@ -1,9 +1,14 @@
 import PowerScriptast
 import PowerScriptbaseobjects
 import PowerScriptbuiltins
+import PowerScriptcache
+import PowerScriptclosures
 import PowerScriptenv
 import PowerScriptexec
 import PowerScriptobjects
 import PowerScriptparser
+import PowerScriptsourcemap
 import PowerScripttokenizer
+import PowerScripttranspiler
+import PowerScriptvm
 import util